@@ -4,8 +4,22 @@ from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from datetime import datetime
+import csv
+import gzip
+import json
+import os
 import re
 
+# multi-path update 1回あたりのおおよそのペイロード上限（バイト）
+FIREBASE_DELETE_MAX_BYTES = 256 * 1024
+# シートの列数 (A列: student_id + entry/exit 4ペア × 6列)
+ATTENDANCE_COLUMN_COUNT = 25
+# batchUpdate 1回で書き込む行数
+WRITE_CHUNK_ROWS = 500
+# ローカルアーカイブの保存先 ({LOCAL_ARCHIVE_DIR}/{YYYY}/{YYYY-MM-DD}.csv.gz)
+# GitHub Actions では attendance-archive ブランチの worktree をここに置き、実行後に push する
+LOCAL_ARCHIVE_DIR = os.environ.get("ATTENDANCE_ARCHIVE_DIR", "attendance_archive")
+
 def initialize_firebase():
     """
     Firebase Admin SDK の初期化を行います。
@@ -44,69 +58,54 @@ def get_attendance_spreadsheet_id():
         raise ValueError("attendance_sheet_id がFirebase上に存在しません。")
     return sheet_id
 
-def add_new_sheet_and_set_filter(sheets_service, spreadsheet_id, sheet_name):
+def storage_sheet_id_for_date(date_str):
+    """
+    日付シートに使う sheetId をクライアント側で決めて返します。
+    YYYY-MM-DD を YYYYMMDD の整数にするため、日付ごとに一意になります。
+    """
+    return int(date_str.replace("-", ""))
+
+def build_add_sheet_requests(sheet_id, sheet_name, row_count):
     """
-    既存のスプレッドシート(spreadsheet_id)に、
-    新しいシート(sheet_name)を追加し、行数2000、列数25に設定。
-    さらに、全列に対してフィルターを設定する。
-    
-    戻り値: 追加したシートの数値ID (sheetId)
+    新しいシート(sheet_name)を sheetId=sheet_id で追加し、行数 row_count、列数25に設定。
+    さらに、全列に対してフィルターを設定する batchUpdate のリクエストを返す。
+    sheetId をクライアント側で指定するため、シート追加の応答を待たずに
+    同じ batchUpdate の中でフィルターやセルの書き込みを続けられる。
     """
-    # 1. シート追加 (batchUpdate -> addSheet)
-    requests_add_sheet = [
+    return [
+        # 1. シート追加 (addSheet)
         {
             "addSheet": {
                 "properties": {
+                    "sheetId": sheet_id,
                     "title": sheet_name,
                     "gridProperties": {
-                        "rowCount": 2000,
-                        "columnCount": 25
+                        "rowCount": row_count,
+                        "columnCount": ATTENDANCE_COLUMN_COUNT
                     }
                 }
             }
-        }
-    ]
-    body_add_sheet = {"requests": requests_add_sheet}
-    response_add = sheets_service.spreadsheets().batchUpdate(
-        spreadsheetId=spreadsheet_id,
-        body=body_add_sheet
-    ).execute()
-
-    # 新規追加されたシートの数値IDを取得
-    new_sheet_id = (
-        response_add["replies"][0]["addSheet"]["properties"]["sheetId"]
-    )
-
-    # 2. フィルターを設定 (batchUpdate -> setBasicFilter)
-    #    シートID = new_sheet_id, 行は0～2000、列は0～25 (0-based index) にフィルターを適用
-    requests_set_filter = [
+        },
+        # 2. フィルターを設定 (setBasicFilter)
+        #    行は0～row_count、列は0～25 (0-based index) にフィルターを適用
         {
             "setBasicFilter": {
                 "filter": {
                     "range": {
-                        "sheetId": new_sheet_id,
+                        "sheetId": sheet_id,
                         "startRowIndex": 0,
-                        "endRowIndex": 2000,     # 実際の行数
+                        "endRowIndex": row_count,     # 実際の行数
                         "startColumnIndex": 0,
-                        "endColumnIndex": 25    # 実際の列数
+                        "endColumnIndex": ATTENDANCE_COLUMN_COUNT    # 実際の列数
                     }
                 }
             }
-        }
+        },
     ]
-    body_set_filter = {"requests": requests_set_filter}
-    sheets_service.spreadsheets().batchUpdate(
-        spreadsheetId=spreadsheet_id,
-        body=body_set_filter
-    ).execute()
-
-    return new_sheet_id
 
-def write_header_row(sheets_service, spreadsheet_id, sheet_name):
+def build_header_row():
     """
-    規定のカラム名を1行目に書き込みます。
-    A列: student_id
-    以下、最大4ペア(entry1/exit1, entry2/exit2, ...)を考慮。
+    シートおよびローカルアーカイブの1行目に使うカラム名のリストを返します。
     """
     header = ["student_id"]
     # entry/exit 1ペアにつき6列 → [entryX, read_datetime, serial_number, exitX, read_datetime, serial_number]
@@ -117,30 +116,200 @@ def write_header_row(sheets_service, spreadsheet_id, sheet_name):
         header.append(f"exit{i}")
         header.append("read_datetime")
         header.append("serial_number")
+    return header
 
-    # A1:Y1 の範囲に書き込み (最大25列)
-    data = [
-        {
-            "range": f"{sheet_name}!A1:Y1",
-            "values": [header]
+def to_cell_data(value):
+    """
+    値を updateCells 用の CellData に変換します (valueInputOption=RAW 相当)。
+    """
+    if value is None or value == "":
+        return {}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+def build_update_rows_request(sheet_id, start_row_index, rows):
+    """
+    start_row_index 行目 (0-based) から rows を書き込む updateCells リクエストを返します。
+    """
+    return {
+        "updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": start_row_index, "columnIndex": 0},
+            "rows": [{"values": [to_cell_data(v) for v in row]} for row in rows],
+            "fields": "userEnteredValue",
         }
-    ]
-    body = {
-        "valueInputOption": "RAW",
-        "data": data
     }
-    sheets_service.spreadsheets().values().batchUpdate(
+
+def delete_paths_from_firebase(ref, paths, max_bytes=FIREBASE_DELETE_MAX_BYTES):
+    """
+    ref からの相対パスのリストを {パス: None} の multi-path update で削除します。
+    JSON にしたときのサイズが max_bytes を超えないよう分割して送信します。
+    """
+    chunk = {}
+    chunk_bytes = 2  # "{}"
+    for path in paths:
+        # "path":null, の分
+        entry_bytes = len(json.dumps(path, ensure_ascii=False).encode("utf-8")) + 6
+        if chunk and chunk_bytes + entry_bytes > max_bytes:
+            ref.update(chunk)
+            print(f"[Debug] Firebase から {len(chunk)} 件のパスを一括削除しました。")
+            chunk = {}
+            chunk_bytes = 2
+        chunk[path] = None
+        chunk_bytes += entry_bytes
+    if chunk:
+        ref.update(chunk)
+        print(f"[Debug] Firebase から {len(chunk)} 件のパスを一括削除しました。")
+
+def build_attendance_row(student_id, actions_dict):
+    """
+    1人分の entryX / exitX を、シート1行分 (A〜Y列) のリストに変換して返します。
+    """
+    # ATTENDANCE_COLUMN_COUNT(25)列分の空欄を用意
+    row_data = [""] * ATTENDANCE_COLUMN_COUNT
+    # A列に student_id
+    row_data[0] = student_id
+
+    # entryX/exitX を最大4ペアぶん一時保管
+    pairs = {
+        1: {"entry": None, "exit": None},
+        2: {"entry": None, "exit": None},
+        3: {"entry": None, "exit": None},
+        4: {"entry": None, "exit": None},
+    }
+
+    # キーが entry1, exit1, entry2, exit2 ... の形を想定
+    for key, val in actions_dict.items():
+        if not isinstance(val, dict):
+            continue
+        if key.startswith("entry") or key.startswith("exit"):
+            m = re.match(r"(entry|exit)(\d+)", key)
+            if m:
+                action_type = m.group(1)  # "entry" or "exit"
+                action_num_str = m.group(2)
+                try:
+                    action_num = int(action_num_str)
+                    if action_num in pairs:
+                        pairs[action_num][action_type] = val
+                except ValueError:
+                    pass
+
+    # ペアごとに row_data に書き込み
+    for i in range(1, 5):
+        col_start = 1 + (i - 1) * 6  # 1ペア=6列、B列(インデックス1)から
+        entry_info = pairs[i]["entry"]
+        exit_info = pairs[i]["exit"]
+
+        if entry_info:
+            row_data[col_start] = f"entry{i}"
+            row_data[col_start+1] = entry_info.get("read_datetime", "")
+            row_data[col_start+2] = entry_info.get("serial_number", "")
+
+        if exit_info:
+            row_data[col_start+3] = f"exit{i}"
+            row_data[col_start+4] = exit_info.get("read_datetime", "")
+            row_data[col_start+5] = exit_info.get("serial_number", "")
+
+    return row_data
+
+def iter_attendance_rows(attendance_data, paths_to_delete):
+    """
+    attendance_data から1行ずつ生成して返すジェネレーター。
+    あわせて、シート書き込み後に削除するパスを paths_to_delete に追加します。
+    """
+    for student_id, actions_dict in attendance_data.items():
+        if not isinstance(actions_dict, dict):
+            continue
+
+        yield build_attendance_row(student_id, actions_dict)
+
+        # entry/exit は、シート書き込みが成功した後に削除する
+        for key in actions_dict.keys():
+            if key.startswith("entry") or key.startswith("exit"):
+                paths_to_delete.append(f"{student_id}/{key}")
+
+        # course_id が存在する場合も削除
+        if "course_id" in actions_dict:
+            paths_to_delete.append(f"{student_id}/course_id")
+
+def send_batch_update(sheets_service, spreadsheet_id, requests):
+    """
+    requests を1回の spreadsheets.batchUpdate で送信します。
+    batchUpdate はすべてのリクエストが適用されるか、1つも適用されないかのどちらかです。
+    """
+    sheets_service.spreadsheets().batchUpdate(
         spreadsheetId=spreadsheet_id,
-        body=body
+        body={"requests": requests}
     ).execute()
+    print(f"[Debug] batchUpdate で {len(requests)} 件のリクエストを送信しました。")
+
+def local_archive_path(date_str, archive_dir=None):
+    """
+    date_str (YYYY-MM-DD) の日のローカルアーカイブのパスを返します。
+    年ごとのディレクトリに、1日1ファイルの gzip 圧縮 CSV として保存します。
+    """
+    return os.path.join(archive_dir or LOCAL_ARCHIVE_DIR, date_str[:4], f"{date_str}.csv.gz")
+
+def open_local_archive(date_str, archive_dir=None):
+    """
+    ローカルアーカイブの書き込み用一時ファイルを開き、ヘッダー行を書き込みます。
+    戻り値: (一時ファイルのパス, gzip ファイル, csv.writer)
+    """
+    path = local_archive_path(date_str, archive_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".partial"
+    gz_file = gzip.open(tmp_path, "wt", encoding="utf-8", newline="")
+    writer = csv.writer(gz_file)
+    writer.writerow(build_header_row())
+    return tmp_path, gz_file, writer
+
+def commit_local_archive(tmp_path):
+    """
+    書き込み済みの一時ファイルを本来のアーカイブファイルに反映します。
+    同じ日付のファイルがすでにある場合は、gzip メンバーとして末尾に追記します（既存の内容は書き換えません）。
+    """
+    path = tmp_path[: -len(".partial")]
+    if not os.path.exists(path):
+        os.replace(tmp_path, path)
+    else:
+        with open(tmp_path, "rb") as src, open(path, "ab") as dst:
+            dst.write(src.read())
+        os.remove(tmp_path)
+    print(f"[Debug] ローカルアーカイブを保存しました: {path}")
+
+def iter_local_archive(start_date, end_date, archive_dir=None):
+    """
+    start_date〜end_date (YYYY-MM-DD, 両端を含む) のローカルアーカイブを読み、
+    (日付, 行のリスト) を1行ずつ返すジェネレーター。ヘッダー行は返しません。
+    """
+    header = build_header_row()
+    base_dir = archive_dir or LOCAL_ARCHIVE_DIR
+    for year in range(int(start_date[:4]), int(end_date[:4]) + 1):
+        year_dir = os.path.join(base_dir, str(year))
+        if not os.path.isdir(year_dir):
+            continue
+        for name in sorted(os.listdir(year_dir)):
+            if not name.endswith(".csv.gz"):
+                continue
+            date_str = name[: -len(".csv.gz")]
+            if not (start_date <= date_str <= end_date):
+                continue
+            with gzip.open(os.path.join(year_dir, name), "rt", encoding="utf-8", newline="") as f:
+                for row in csv.reader(f):
+                    if row != header:
+                        yield date_str, row
 
 def export_attendance_data():
     """
-    1) Firebaseから attendance_sheet_id を取得し、
-       その既存スプレッドシートに当日の日付シートを追加
-       (同時に全列フィルターを設定)
-    2) Students/attendance/student_id/{student_id} 以下の entryX / exitX データを取得
-    3) 取得した情報をシートに書き込み、Firebase から entryX / exitX を削除
+    1) Firebaseから attendance_sheet_id と
+       Students/attendance/student_id/{student_id} 以下の entryX / exitX データを取得
+    2) 既存スプレッドシートに、学生数に合わせた行数で当日の日付シートを追加し、
+       全列フィルター・ヘッダー行・取得した情報を同じ batchUpdate で書き込む
+    3) 取得した情報は WRITE_CHUNK_ROWS 行ずつ batchUpdate で送り、
+       同じ行をローカルアーカイブ (LOCAL_ARCHIVE_DIR) にも保存
+    4) シートへの書き込みが成功した後に Firebase から entryX / exitX / course_id をまとめて削除
     """
     # Firebase初期化
     initialize_firebase()
@@ -153,99 +322,56 @@ def export_attendance_data():
     # 実行日をシート名に
     today_str = datetime.now().strftime("%Y-%m-%d")
 
-    # 新しいシートを追加し、全列フィルターを適用
-    add_new_sheet_and_set_filter(sheets_service, spreadsheet_id, today_str)
-
-    # ヘッダー行を記入
-    write_header_row(sheets_service, spreadsheet_id, today_str)
-
     # Firebaseから出席情報を取得
     attendance_ref = db.reference("Students/attendance/student_id")
     attendance_data = attendance_ref.get() or {}
 
-    # 書き込み用データ
-    rows_to_write = []
-    current_row = 2  # 2行目から書き込み
+    # ヘッダー行 + 学生数ぶんの行数で新しいシートを追加し、全列フィルターを適用。
+    # sheetId をクライアント側で決めておき、シート追加・フィルター・ヘッダー行・最初の
+    # WRITE_CHUNK_ROWS 行を1回の batchUpdate で送る。
+    row_count = 1 + sum(1 for actions_dict in attendance_data.values() if isinstance(actions_dict, dict))
+    sheet_id = storage_sheet_id_for_date(today_str)
+    requests = build_add_sheet_requests(sheet_id, today_str, row_count)
+    requests.append(build_update_rows_request(sheet_id, 0, [build_header_row()]))
 
-    # student_id ごとに処理
-    for student_id, actions_dict in attendance_data.items():
-        if not isinstance(actions_dict, dict):
-            continue
+    # シート書き込み後に削除するパス (attendance_ref からの相対パス)
+    paths_to_delete = []
+    next_row_index = 1  # 2行目 (0-based で 1) から書き込み
+    chunk = []
 
-        # 25列分の空欄を用意
-        row_data = [""] * 25
-        # A列に student_id
-        row_data[0] = student_id
-
-        # entryX/exitX を最大4ペアぶん一時保管
-        pairs = {
-            1: {"entry": None, "exit": None},
-            2: {"entry": None, "exit": None},
-            3: {"entry": None, "exit": None},
-            4: {"entry": None, "exit": None},
-        }
+    # 同じ行をローカルアーカイブ (gzip 圧縮 CSV) にも書き込む
+    archive_tmp_path, archive_file, archive_writer = open_local_archive(today_str)
+    try:
+        # 行を生成しながら、WRITE_CHUNK_ROWS 行ずつシートに書き込む
+        for row_data in iter_attendance_rows(attendance_data, paths_to_delete):
+            archive_writer.writerow(row_data)
+            chunk.append(row_data)
+            if len(chunk) >= WRITE_CHUNK_ROWS:
+                requests.append(build_update_rows_request(sheet_id, next_row_index, chunk))
+                send_batch_update(sheets_service, spreadsheet_id, requests)
+                next_row_index += len(chunk)
+                requests = []
+                chunk = []
+        if chunk:
+            requests.append(build_update_rows_request(sheet_id, next_row_index, chunk))
+        if requests:
+            send_batch_update(sheets_service, spreadsheet_id, requests)
+    except Exception:
+        # シートへの書き込みに失敗した場合はアーカイブにも残さない
+        archive_file.close()
+        os.remove(archive_tmp_path)
+        raise
 
-        # キーが entry1, exit1, entry2, exit2 ... の形を想定
-        for key, val in actions_dict.items():
-            if not isinstance(val, dict):
-                continue
-            if key.startswith("entry") or key.startswith("exit"):
-                m = re.match(r"(entry|exit)(\d+)", key)
-                if m:
-                    action_type = m.group(1)  # "entry" or "exit"
-                    action_num_str = m.group(2)
-                    try:
-                        action_num = int(action_num_str)
-                        if action_num in pairs:
-                            pairs[action_num][action_type] = val
-                    except ValueError:
-                        pass
-
-        # ペアごとに row_data に書き込み
-        for i in range(1, 5):
-            col_start = 1 + (i - 1) * 6  # 1ペア=6列、B列(インデックス1)から
-            entry_info = pairs[i]["entry"]
-            exit_info = pairs[i]["exit"]
-
-            if entry_info:
-                row_data[col_start] = f"entry{i}"
-                row_data[col_start+1] = entry_info.get("read_datetime", "")
-                row_data[col_start+2] = entry_info.get("serial_number", "")
-
-            if exit_info:
-                row_data[col_start+3] = f"exit{i}"
-                row_data[col_start+4] = exit_info.get("read_datetime", "")
-                row_data[col_start+5] = exit_info.get("serial_number", "")
-
-        rows_to_write.append(row_data)
-
-        # Firebase から entry/exit を削除
-        for key in list(actions_dict.keys()):
-            if key.startswith("entry") or key.startswith("exit"):
-                attendance_ref.child(student_id).child(key).delete()
-        
-        # course_id が存在する場合も削除
-        if "course_id" in actions_dict:
-            attendance_ref.child(student_id).child("course_id").delete()
-
-        current_row += 1
-
-    # スプレッドシートに一括書き込み
-    if rows_to_write:
-        range_notation = f"{today_str}!A2:Y{1 + len(rows_to_write)}"
-        body = {
-            "valueInputOption": "RAW",
-            "data": [
-                {
-                    "range": range_notation,
-                    "values": rows_to_write
-                }
-            ]
-        }
-        sheets_service.spreadsheets().values().batchUpdate(
-            spreadsheetId=spreadsheet_id,
-            body=body
-        ).execute()
+    archive_file.close()
+    try:
+        commit_local_archive(archive_tmp_path)
+    except OSError as e:
+        # シートには書き込めているため、アーカイブの失敗では Firebase の削除を止めない
+        print(f"[Debug] ローカルアーカイブの保存に失敗しました: {e}")
+
+    # シートへの書き込みが確認できてから、Firebase の entry/exit/course_id をまとめて削除
+    if paths_to_delete:
+        delete_paths_from_firebase(attendance_ref, paths_to_delete)
 
     print("出席データのエクスポートが完了しました。")
 
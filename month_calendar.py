@@ -0,0 +1,99 @@
+# 月ごとのカレンダー (日付ヘッダーと土日の列) を1回だけ計算して使い回す
+# (write_schedule.py / write_class_schedule.py / write_course_schedule.py で共通に使う)
+import calendar
+from datetime import date
+from functools import lru_cache
+
+JAPANESE_WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+
+# 土曜日・日曜日の背景色
+SATURDAY_COLOR = {"red": 0.8, "green": 0.9, "blue": 1.0}
+SUNDAY_COLOR = {"red": 1.0, "green": 0.8, "blue": 0.8}
+
+# 年度の開始月 (4月始まり)
+ACADEMIC_YEAR_START_MONTH = 4
+
+
+class MonthCalendar:
+    """
+    1か月分の日付ヘッダー文字列と土日の日付を保持します。
+    get_month_calendar(year, month) から取得してください。
+    """
+
+    __slots__ = ("year", "month", "date_headers", "weekend_days")
+
+    def __init__(self, year, month):
+        self.year = year
+        self.month = month
+        first_weekday, days_in_month = calendar.monthrange(year, month)
+
+        date_headers = []
+        weekend_days = []
+        for day in range(1, days_in_month + 1):
+            weekday = (first_weekday + day - 1) % 7  # 月=0, 日=6
+            date_headers.append(
+                f"{month:02d}\n月\n"
+                f"{day:02d}\n日\n⌢\n"
+                f"{JAPANESE_WEEKDAYS[weekday]}\n⌣"
+            )
+            # 土曜日(5)・日曜日(6)
+            if weekday == 5:
+                weekend_days.append((day, SATURDAY_COLOR))
+            elif weekday == 6:
+                weekend_days.append((day, SUNDAY_COLOR))
+        self.date_headers = tuple(date_headers)
+        self.weekend_days = tuple(weekend_days)
+
+    @property
+    def sheet_title(self):
+        return f"{self.year}-{self.month:02d}"
+
+    def date_header_cells(self, start_column, columns_per_day=1):
+        """
+        日付ヘッダーを書き込む (列番号, 文字列) のリストを返します。
+        start_column が1日目の列、1日あたり columns_per_day 列です。
+        """
+        return [
+            (start_column + index * columns_per_day, header)
+            for index, header in enumerate(self.date_headers)
+        ]
+
+    def weekend_column_ranges(self, start_column, columns_per_day=1):
+        """
+        土日の列範囲 (開始列, 終了列(含まない), 背景色) のリストを返します。
+        """
+        return [
+            (
+                start_column + (day - 1) * columns_per_day,
+                start_column + day * columns_per_day,
+                dict(color),
+            )
+            for day, color in self.weekend_days
+        ]
+
+
+@lru_cache(maxsize=None)
+def get_month_calendar(year, month):
+    """
+    (year, month) ごとにキャッシュした MonthCalendar を返します。
+    """
+    return MonthCalendar(year, month)
+
+
+def current_academic_year(today=None):
+    """
+    今日の日付が属する年度を返します (ACADEMIC_YEAR_START_MONTH より前の月は前年度)。
+    """
+    today = today or date.today()
+    return today.year if today.month >= ACADEMIC_YEAR_START_MONTH else today.year - 1
+
+
+def academic_year_months(academic_year):
+    """
+    年度 academic_year の12か月分の (year, month) を、年度の開始月から順に返します。
+    """
+    months = []
+    for offset in range(12):
+        month_index = ACADEMIC_YEAR_START_MONTH - 1 + offset
+        months.append((academic_year + month_index // 12, month_index % 12 + 1))
+    return months
@@ -0,0 +1,88 @@
+import datetime
+from functools import lru_cache
+
+# カードリーダーが記録する read_datetime の書式
+READ_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@lru_cache(maxsize=65536)
+def parse_read_datetime(dt_str):
+    """
+    "YYYY-MM-DD HH:MM:SS" 形式の read_datetime 文字列を datetime に変換して返す。
+    固定位置のスライスで変換し、同じ文字列の再変換はキャッシュから返す。
+    固定長でない文字列は strptime にフォールバックする。変換できない場合は ValueError。
+    """
+    if (
+        len(dt_str) == 19
+        and dt_str[4] == "-"
+        and dt_str[7] == "-"
+        and dt_str[10] == " "
+        and dt_str[13] == ":"
+        and dt_str[16] == ":"
+        and dt_str[0:4].isdigit()
+        and dt_str[5:7].isdigit()
+        and dt_str[8:10].isdigit()
+        and dt_str[11:13].isdigit()
+        and dt_str[14:16].isdigit()
+        and dt_str[17:19].isdigit()
+    ):
+        return datetime.datetime(
+            int(dt_str[0:4]),
+            int(dt_str[5:7]),
+            int(dt_str[8:10]),
+            int(dt_str[11:13]),
+            int(dt_str[14:16]),
+            int(dt_str[17:19]),
+        )
+    return datetime.datetime.strptime(dt_str, READ_DATETIME_FORMAT)
+
+
+def format_read_datetime(dt):
+    """
+    datetime を "YYYY-MM-DD HH:MM:SS" 形式の read_datetime 文字列に変換して返す。
+    """
+    return dt.isoformat(sep=" ", timespec="seconds")
+
+
+def run_benchmark(count=100000):
+    """
+    strptime/strftime と比較するマイクロベンチマーク。
+    python read_datetime.py で実行する。
+    """
+    import random
+    import timeit
+
+    random.seed(0)
+    base = datetime.datetime(2025, 4, 1, 8, 0, 0)
+    # 実データと同様に、1日分の打刻は同じ文字列が何度も現れる
+    samples = [
+        (base + datetime.timedelta(seconds=random.randint(0, 9 * 3600))).strftime(READ_DATETIME_FORMAT)
+        for _ in range(count)
+    ]
+    parsed = [datetime.datetime.strptime(s, READ_DATETIME_FORMAT) for s in samples]
+    assert [parse_read_datetime(s) for s in samples] == parsed
+    assert [format_read_datetime(d) for d in parsed] == samples
+
+    def bench(label, func):
+        seconds = min(timeit.repeat(func, number=1, repeat=3))
+        print(f"{label:<32} {seconds * 1000:8.1f} ms")
+        return seconds
+
+    print(f"[Bench] {count} timestamps")
+    t_strptime = bench("strptime", lambda: [datetime.datetime.strptime(s, READ_DATETIME_FORMAT) for s in samples])
+
+    def parse_cold():
+        parse_read_datetime.cache_clear()
+        return [parse_read_datetime(s) for s in samples]
+
+    t_cold = bench("parse_read_datetime (cold cache)", parse_cold)
+    t_warm = bench("parse_read_datetime (warm cache)", lambda: [parse_read_datetime(s) for s in samples])
+    t_strftime = bench("strftime", lambda: [d.strftime(READ_DATETIME_FORMAT) for d in parsed])
+    t_format = bench("format_read_datetime", lambda: [format_read_datetime(d) for d in parsed])
+
+    print(f"[Bench] parse speedup: cold x{t_strptime / t_cold:.1f}, warm x{t_strptime / t_warm:.1f}")
+    print(f"[Bench] format speedup: x{t_strftime / t_format:.1f}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,79 @@
+# スプレッドシートのシート一覧を1回の実行の中でキャッシュする
+# (write_schedule.py / write_class_schedule.py / write_course_schedule.py で共通に使う)
+
+# シート名と sheetId だけを取得するための fields マスク
+SHEET_METADATA_FIELDS = "sheets.properties(sheetId,title)"
+
+
+class SheetMetadataCache:
+    """
+    スプレッドシートIDごとに、既存のシート名と sheetId をキャッシュします。
+    最初の参照時に fields マスク付きの spreadsheets().get() を1回だけ実行し、
+    以降はシートを追加するたびにローカルで更新します。
+    """
+
+    def __init__(self, sheets_service, execute=None):
+        self.sheets_service = sheets_service
+        # リトライ付きで実行したい場合は execute_with_retry などを渡す
+        self.execute = execute or (lambda request: request.execute())
+        # spreadsheet_id -> {"titles": set, "sheet_ids": set}
+        self.entries = {}
+        self.fetch_count = 0
+
+    def _get_entry(self, spreadsheet_id):
+        entry = self.entries.get(spreadsheet_id)
+        if entry is None:
+            print(f"[Debug] Fetching sheet titles for spreadsheet: {spreadsheet_id}")
+            response = self.execute(
+                self.sheets_service.spreadsheets().get(
+                    spreadsheetId=spreadsheet_id, fields=SHEET_METADATA_FIELDS
+                )
+            )
+            self.fetch_count += 1
+            sheets = response.get("sheets", [])
+            entry = {
+                "titles": {sheet["properties"]["title"] for sheet in sheets},
+                "sheet_ids": {sheet["properties"]["sheetId"] for sheet in sheets},
+            }
+            self.entries[spreadsheet_id] = entry
+        return entry
+
+    def titles(self, spreadsheet_id):
+        """
+        既存のシート名の集合を返します。
+        """
+        return self._get_entry(spreadsheet_id)["titles"]
+
+    def sheet_ids(self, spreadsheet_id):
+        """
+        既存の sheetId の集合を返します。
+        """
+        return self._get_entry(spreadsheet_id)["sheet_ids"]
+
+    def add_sheet(self, spreadsheet_id, title, sheet_id=None):
+        """
+        シートを追加した（または追加する予定の）シート名と sheetId をキャッシュに反映します。
+        """
+        entry = self._get_entry(spreadsheet_id)
+        entry["titles"].add(title)
+        if sheet_id is not None:
+            entry["sheet_ids"].add(sheet_id)
+
+    def remove_sheet(self, spreadsheet_id, title, sheet_id):
+        """
+        削除したシートのシート名と sheetId をキャッシュから取り除きます。
+        """
+        entry = self._get_entry(spreadsheet_id)
+        entry["titles"].discard(title)
+        entry["sheet_ids"].discard(sheet_id)
+
+    def allocate_sheet_id(self, spreadsheet_id, preferred_id):
+        """
+        既存と重複しない sheetId を preferred_id から順に探して返し、キャッシュに追加します。
+        """
+        sheet_ids = self.sheet_ids(spreadsheet_id)
+        sheet_id = preferred_id
+        while sheet_id in sheet_ids:
+            sheet_id += 1
+        sheet_ids.add(sheet_id)
+        return sheet_id
@@ -0,0 +1,111 @@
+# batchUpdate のリクエストをまとめて、サブリクエスト数とペイロードを減らす
+# (write_schedule.py / write_class_schedule.py / write_course_schedule.py で共通に使う)
+
+# 値を書き換えないため、1セル分の値の書き込みを後ろへまとめても結果が変わらないリクエスト
+VALUE_INDEPENDENT_REQUESTS = {
+    "addSheet",
+    "appendDimension",
+    "updateDimensionProperties",
+    "updateBorders",
+    "setBasicFilter",
+}
+
+
+def _is_single_value_update(request):
+    """
+    1セルに値だけを書き込む updateCells かどうかを返します。
+    """
+    update = request.get("updateCells")
+    if not update or "start" not in update or update.get("fields") != "userEnteredValue":
+        return False
+    rows = update.get("rows", [])
+    return len(rows) == 1 and len(rows[0].get("values", [])) == 1
+
+
+def _writes_values(request):
+    """
+    セルの値を書き換える可能性があるリクエストかどうかを返します。
+    """
+    (kind, body), = request.items()
+    if kind in VALUE_INDEPENDENT_REQUESTS:
+        return False
+    if kind in ("repeatCell", "updateCells"):
+        fields = [f.strip() for f in body.get("fields", "").split(",")]
+        return any(f in ("*", "userEnteredValue") or f.startswith("userEnteredValue.") for f in fields)
+    return True
+
+
+def _build_value_blocks(sheet_id, cells):
+    """
+    {(row, col): CellData} を、横に連続するセルを1行にまとめ、
+    同じ列範囲が縦に続く行をさらに1つの updateCells にまとめて返します。
+    """
+    # 行ごとに、列が連続する範囲 (開始列, 終了列, CellData のリスト) を作る
+    runs_by_row = {}
+    for row, col in sorted(cells):
+        runs = runs_by_row.setdefault(row, [])
+        if runs and runs[-1][1] == col:
+            runs[-1][1] = col + 1
+            runs[-1][2].append(cells[(row, col)])
+        else:
+            runs.append([col, col + 1, [cells[(row, col)]]])
+
+    # 同じ列範囲が前の行から続いていれば、同じブロックに追加する
+    blocks = []
+    open_blocks = {}  # (開始列, 終了列) -> ブロック
+    for row in sorted(runs_by_row):
+        for start_col, end_col, values in runs_by_row[row]:
+            block = open_blocks.get((start_col, end_col))
+            if block is not None and block["end_row"] == row:
+                block["rows"].append({"values": values})
+                block["end_row"] = row + 1
+            else:
+                block = {"start_row": row, "end_row": row + 1, "start_col": start_col, "rows": [{"values": values}]}
+                open_blocks[(start_col, end_col)] = block
+                blocks.append(block)
+
+    return [
+        {
+            "updateCells": {
+                "rows": block["rows"],
+                "start": {"sheetId": sheet_id, "rowIndex": block["start_row"], "columnIndex": block["start_col"]},
+                "fields": "userEnteredValue",
+            }
+        }
+        for block in blocks
+    ]
+
+
+def coalesce_requests(requests):
+    """
+    batchUpdate のリクエストリストを、結果を変えずに少ないサブリクエストへまとめて返します。
+
+    1セルずつの値の書き込み (updateCells) は、シートごとに縦横に連続する範囲を
+    まとめた updateCells にする。値を書き換えうるリクエストの直前、または最後にまとめて出力する。
+    それ以外のリクエストは順序を変えずにそのまま出力する。
+    """
+    coalesced = []
+    pending_cells = {}  # sheetId -> {(row, col): CellData}
+
+    def flush_pending_cells():
+        for sheet_id, cells in pending_cells.items():
+            coalesced.extend(_build_value_blocks(sheet_id, cells))
+        pending_cells.clear()
+
+    for request in requests:
+        if _is_single_value_update(request):
+            update = request["updateCells"]
+            start = update["start"]
+            cell = update["rows"][0]["values"][0]
+            pending_cells.setdefault(start["sheetId"], {})[
+                (start.get("rowIndex", 0), start.get("columnIndex", 0))
+            ] = cell
+            continue
+
+        if _writes_values(request):
+            flush_pending_cells()
+        coalesced.append(request)
+
+    flush_pending_cells()
+    print(f"[Debug] coalesce_requests: {len(requests)} -> {len(coalesced)} requests")
+    return coalesced
@@ -0,0 +1,60 @@
+# テンプレートシートを1つ作って duplicateSheet で月ごとのシートを作成する
+# (write_schedule.py / write_class_schedule.py / write_course_schedule.py の --template モードで使う)
+
+# 作成中だけ存在するテンプレートシートのシート名 (同じ batchUpdate の最後で削除する)
+TEMPLATE_SHEET_TITLE = "template"
+
+
+def allocate_template_sheet(metadata_cache, spreadsheet_id, preferred_id):
+    """
+    既存のシートと重複しないテンプレートシートのシート名と sheetId を決め、
+    metadata_cache (SheetMetadataCache) に反映して (シート名, sheetId) を返します。
+    """
+    existing_titles = metadata_cache.titles(spreadsheet_id)
+    title = TEMPLATE_SHEET_TITLE
+    index = 1
+    while title in existing_titles:
+        title = f"{TEMPLATE_SHEET_TITLE}-{index}"
+        index += 1
+    sheet_id = metadata_cache.allocate_sheet_id(spreadsheet_id, preferred_id)
+    metadata_cache.add_sheet(spreadsheet_id, title, sheet_id)
+    return title, sheet_id
+
+
+def create_duplicate_sheet_request(source_sheet_id, new_sheet_id, new_sheet_title, insert_index):
+    """
+    source_sheet_id のシートを複製して、sheetId=new_sheet_id、シート名=new_sheet_title のシートを
+    insert_index の位置に追加するリクエストを作成します。
+    """
+    return {
+        "duplicateSheet": {
+            "sourceSheetId": source_sheet_id,
+            "insertSheetIndex": insert_index,
+            "newSheetId": new_sheet_id,
+            "newSheetName": new_sheet_title,
+        }
+    }
+
+
+def build_template_provisioning_requests(add_template_request, template_sheet_id, layout_requests, month_sheets, first_index):
+    """
+    テンプレートシートから月ごとのシートを作成する batchUpdate のリクエストを返します。
+
+    - add_template_request: テンプレートシート (sheetId=template_sheet_id) を追加するリクエスト
+    - layout_requests: 全月で共通の書式・固定の文字列をテンプレートシートに設定するリクエスト
+    - month_sheets: [(sheetId, シート名, その月だけのリクエスト), ...]
+    - first_index: 1か月目のシートを置く位置 (既存のシート数)
+
+    テンプレートシートは既存シートの後ろに追加し、各月のシートをその後ろに複製したうえで、
+    最後にテンプレートシートを削除します。
+    """
+    requests = [add_template_request]
+    requests.extend(layout_requests)
+    for offset, (new_sheet_id, sheet_title, month_requests) in enumerate(month_sheets):
+        # テンプレートシートが first_index にあるため、その次の位置から並べる
+        requests.append(
+            create_duplicate_sheet_request(template_sheet_id, new_sheet_id, sheet_title, first_index + 1 + offset)
+        )
+        requests.extend(month_requests)
+    requests.append({"deleteSheet": {"sheetId": template_sheet_id}})
+    return requests
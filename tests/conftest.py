@@ -0,0 +1,89 @@
+# テストでは Firebase / Google の認証情報やクライアントライブラリが無いため、
+# スクリプトの import 時に使われるクライアントを sys.modules のスタブに差し替える
+import os
+import sys
+import types
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def rowcol_to_a1(row, col):
+    """
+    gspread.utils.rowcol_to_a1 と同じく (行, 列) を "A1" 形式に変換する。
+    """
+    letters = ""
+    while col > 0:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return f"{letters}{row}"
+
+
+def install_stub_modules():
+    firebase_admin = types.ModuleType("firebase_admin")
+    # 初期化済みとして扱い、initialize_app を呼ばせない
+    firebase_admin._apps = {"[DEFAULT]": object()}
+    firebase_admin.initialize_app = mock.Mock()
+    firebase_admin.credentials = types.ModuleType("firebase_admin.credentials")
+    firebase_admin.credentials.Certificate = mock.Mock()
+    firebase_admin.db = types.ModuleType("firebase_admin.db")
+    firebase_admin.db.reference = mock.Mock()
+
+    gspread = types.ModuleType("gspread")
+    gspread.authorize = mock.Mock()
+    gspread.utils = types.ModuleType("gspread.utils")
+    gspread.utils.rowcol_to_a1 = rowcol_to_a1
+    gspread.exceptions = types.ModuleType("gspread.exceptions")
+    for name in ("APIError", "SpreadsheetNotFound", "WorksheetNotFound"):
+        setattr(gspread.exceptions, name, type(name, (Exception,), {}))
+
+    oauth2client = types.ModuleType("oauth2client")
+    oauth2client.service_account = types.ModuleType("oauth2client.service_account")
+    oauth2client.service_account.ServiceAccountCredentials = mock.Mock()
+
+    google = types.ModuleType("google")
+    google.oauth2 = types.ModuleType("google.oauth2")
+    google.oauth2.service_account = types.ModuleType("google.oauth2.service_account")
+    google.oauth2.service_account.Credentials = mock.Mock()
+
+    google.auth = types.ModuleType("google.auth")
+    google.auth.transport = types.ModuleType("google.auth.transport")
+    google.auth.transport.requests = types.ModuleType("google.auth.transport.requests")
+    google.auth.transport.requests.Request = mock.Mock()
+    google_auth_httplib2 = types.ModuleType("google_auth_httplib2")
+    google_auth_httplib2.AuthorizedHttp = mock.Mock()
+    httplib2 = types.ModuleType("httplib2")
+    httplib2.Http = mock.Mock()
+
+    googleapiclient = types.ModuleType("googleapiclient")
+    googleapiclient.discovery = types.ModuleType("googleapiclient.discovery")
+    googleapiclient.discovery.build = mock.Mock()
+    googleapiclient.errors = types.ModuleType("googleapiclient.errors")
+    googleapiclient.errors.HttpError = type("HttpError", (Exception,), {})
+
+    sys.modules.update(
+        {
+            "firebase_admin": firebase_admin,
+            "firebase_admin.credentials": firebase_admin.credentials,
+            "firebase_admin.db": firebase_admin.db,
+            "gspread": gspread,
+            "gspread.utils": gspread.utils,
+            "gspread.exceptions": gspread.exceptions,
+            "oauth2client": oauth2client,
+            "oauth2client.service_account": oauth2client.service_account,
+            "google": google,
+            "google.oauth2": google.oauth2,
+            "google.oauth2.service_account": google.oauth2.service_account,
+            "google.auth": google.auth,
+            "google.auth.transport": google.auth.transport,
+            "google.auth.transport.requests": google.auth.transport.requests,
+            "google_auth_httplib2": google_auth_httplib2,
+            "httplib2": httplib2,
+            "googleapiclient": googleapiclient,
+            "googleapiclient.discovery": googleapiclient.discovery,
+            "googleapiclient.errors": googleapiclient.errors,
+        }
+    )
+
+
+install_stub_modules()
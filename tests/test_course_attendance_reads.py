@@ -0,0 +1,73 @@
+# write_course_attendance.main() の Firebase 読み込み回数が学生数に依存しないことを確認する
+from unittest import mock
+
+import pytest
+
+import write_course_attendance
+
+COURSE_COUNT = 5
+SHEET_NAME = "2025-01"
+
+
+def build_database(student_count):
+    """
+    COURSE_COUNT 件のコース (すべて月曜) と student_count 人の学生を持つ Firebase のデータを作る。
+    """
+    courses = [None] + [
+        {"course_name": f"c{i}", "course_sheet_id": f"sheet{i}", "schedule": {"day": "Monday", "period": 1}}
+        for i in range(1, COURSE_COUNT + 1)
+    ]
+    student_index = {}
+    attendance = {}
+    enrollment = {str(i): {"student_index": ""} for i in range(1, COURSE_COUNT + 1)}
+    for n in range(student_count):
+        student_idx = f"E5{n:02d}"
+        student_id = f"S{n:03d}"
+        student_index[student_idx] = {"student_id": student_id}
+        course_id = n % COURSE_COUNT + 1
+        attendance[student_id] = {"course_id": {str(course_id): {"decision": "〇"}}}
+        enrolled = enrollment[str(course_id)]["student_index"]
+        enrollment[str(course_id)]["student_index"] = f"{enrolled}, {student_idx}" if enrolled else student_idx
+
+    return {
+        "Courses/course_id": courses,
+        "Students/enrollment/course_id": enrollment,
+        "Students/student_info/student_index": student_index,
+        "Students/attendance/student_id": attendance,
+    }
+
+
+class FakeDatabase:
+    """
+    db.reference(path).get() を、パスごとのデータで返す。get() の回数を記録する。
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.get_calls = []
+
+    def reference(self, path):
+        ref = mock.Mock()
+        ref.get.side_effect = lambda: self.get_calls.append(path) or self.data.get(path)
+        return ref
+
+
+@pytest.mark.parametrize("student_count", [5, 50, 200])
+def test_firebase_reads_do_not_grow_with_students(monkeypatch, student_count):
+    database = FakeDatabase(build_database(student_count))
+    gclient = mock.MagicMock()
+    monkeypatch.setattr(write_course_attendance.db, "reference", database.reference)
+    monkeypatch.setattr(write_course_attendance, "gclient", gclient)
+    monkeypatch.setattr(write_course_attendance, "firebase_read_count", 0)
+    monkeypatch.setattr(
+        write_course_attendance, "get_current_date_details", lambda: ("Monday", SHEET_NAME, 6)
+    )
+
+    write_course_attendance.main()
+
+    assert write_course_attendance.firebase_read_count == 4
+    assert len(database.get_calls) == 4
+    # 各コースのシートは1回ずつ開き、当日の列を1回の update で書き込む
+    assert gclient.open_by_key.call_count == COURSE_COUNT
+    worksheet = gclient.open_by_key.return_value.worksheet.return_value
+    assert worksheet.update.call_count == COURSE_COUNT
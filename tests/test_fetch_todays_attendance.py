@@ -0,0 +1,93 @@
+# fetch_todays_attendance が entry1～entry4 のいずれかが当日の学生をすべて取得することを確認する
+import pytest
+
+import write_attendance
+
+TODAY = "2025-01-06"
+
+ATTENDANCE = {
+    # entry1 が当日
+    "S001": {"entry1": {"read_datetime": f"{TODAY} 08:45:00"}},
+    # entry1 は前日で、当日最初の入室は entry2
+    "S002": {
+        "entry1": {"read_datetime": "2025-01-05 08:45:00"},
+        "entry2": {"read_datetime": f"{TODAY} 10:25:00"},
+    },
+    # entry1 が無く、当日最初の入室は entry2
+    "S003": {"entry2": {"read_datetime": f"{TODAY} 13:05:00"}},
+    # 当日の入室が無い
+    "S004": {"entry1": {"read_datetime": "2025-01-05 08:45:00"}},
+    "S005": {"course_id": {}},
+}
+
+
+class FakeQuery:
+    def __init__(self, data, child_path):
+        self.data = data
+        self.child_path = child_path
+        self.start = None
+        self.end = None
+
+    def start_at(self, value):
+        self.start = value
+        return self
+
+    def end_at(self, value):
+        self.end = value
+        return self
+
+    def value_of(self, att_dict):
+        value = att_dict
+        for key in self.child_path.split("/"):
+            value = value.get(key) if isinstance(value, dict) else None
+        return value
+
+    def get(self):
+        return {
+            student_id: att_dict
+            for student_id, att_dict in self.data.items()
+            if isinstance(self.value_of(att_dict), str) and self.start <= self.value_of(att_dict) <= self.end
+        }
+
+
+class FakeReference:
+    def __init__(self, database, path, indexed):
+        self.database = database
+        self.path = path
+        self.indexed = indexed
+
+    def order_by_child(self, child_path):
+        if not self.indexed:
+            raise ValueError("Index not defined")
+        self.database.calls.append(("query", child_path))
+        return FakeQuery(self.database.data, child_path)
+
+    def get(self):
+        self.database.calls.append(("get", self.path))
+        return self.database.data
+
+
+class FakeDatabase:
+    def __init__(self, data, indexed):
+        self.data = data
+        self.indexed = indexed
+        self.calls = []
+
+    def reference(self, path):
+        return FakeReference(self, path, self.indexed)
+
+
+@pytest.mark.parametrize("indexed", [True, False], ids=["range-query", "full-fetch-fallback"])
+def test_includes_students_whose_first_entry_today_is_entry2(monkeypatch, indexed):
+    database = FakeDatabase(ATTENDANCE, indexed)
+    monkeypatch.setattr(write_attendance.db, "reference", database.reference)
+
+    result = write_attendance.fetch_todays_attendance(TODAY)
+
+    assert sorted(result) == ["S001", "S002", "S003"]
+    assert result["S002"] == ATTENDANCE["S002"]
+    if indexed:
+        assert [call for call in database.calls if call[0] == "get"] == []
+    else:
+        # フォールバック時も学生ごとではなく1回の全件取得で済ませる
+        assert database.calls == [("get", write_attendance.ATTENDANCE_PATH)]
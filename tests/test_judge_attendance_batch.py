@@ -0,0 +1,116 @@
+# judge_attendance_batch が judge_attendance_for_period と同じ判定を返すことを確認する差分テスト
+import datetime
+import random
+
+import pytest
+
+import write_attendance
+
+np = pytest.importorskip("numpy")
+
+MISSING = np.iinfo(np.int64).min
+BASE_DATE = datetime.date(2025, 4, 7)
+
+
+def period_bounds(period):
+    start_hhmm, finish_hhmm = write_attendance.PERIOD_TIME_MAP[period]
+    start_dt = write_attendance.combine_date_and_time(BASE_DATE, write_attendance.parse_hhmm(start_hhmm))
+    finish_dt = write_attendance.combine_date_and_time(BASE_DATE, write_attendance.parse_hhmm(finish_hhmm))
+    return start_dt, finish_dt
+
+
+def boundary_cases():
+    """
+    開始+5分・終了±5分の前後1秒と、入室/退室の欠損を組み合わせたケース。
+    """
+    cases = []
+    for period in write_attendance.PERIOD_TIME_MAP:
+        start_dt, finish_dt = period_bounds(period)
+        points = [None]
+        for anchor in (start_dt, start_dt + datetime.timedelta(minutes=5),
+                       finish_dt - datetime.timedelta(minutes=5), finish_dt,
+                       finish_dt + datetime.timedelta(minutes=5)):
+            points.extend(anchor + datetime.timedelta(seconds=s) for s in (-1, 0, 1))
+        for entry_dt in points:
+            for exit_dt in points:
+                cases.append((entry_dt, exit_dt, start_dt, finish_dt))
+    return cases
+
+
+def random_cases(count, seed):
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        start_dt, finish_dt = period_bounds(rng.randint(1, 4))
+
+        def random_time():
+            if rng.random() < 0.15:
+                return None
+            return start_dt + datetime.timedelta(seconds=rng.randint(-3600, 3 * 3600))
+
+        cases.append((random_time(), random_time(), start_dt, finish_dt))
+    return cases
+
+
+def to_datetime64(values):
+    return np.array(
+        [np.datetime64(v) if v is not None else np.datetime64("NaT") for v in values], dtype="datetime64[s]"
+    )
+
+
+def to_epoch(values):
+    return np.array(
+        [int(v.replace(tzinfo=datetime.timezone.utc).timestamp()) if v is not None else MISSING for v in values],
+        dtype=np.int64,
+    )
+
+
+def from_datetime64(value):
+    return None if np.isnat(value) else value.astype(datetime.datetime)
+
+
+def from_epoch(value):
+    if value == MISSING:
+        return None
+    return datetime.datetime.fromtimestamp(int(value), tz=datetime.timezone.utc).replace(tzinfo=None)
+
+
+def assert_matches_scalar(cases, convert, restore):
+    entry_ts, exit_ts, start_ts, finish_ts = (convert(column) for column in zip(*cases))
+    result = write_attendance.judge_attendance_batch(entry_ts, exit_ts, start_ts, finish_ts)
+
+    for i, (entry_dt, exit_dt, start_dt, finish_dt) in enumerate(cases):
+        status, _, new_exit_dt, next_period_data = write_attendance.judge_attendance_for_period(
+            entry_dt, exit_dt, start_dt, finish_dt
+        )
+        next_entry = restore(result["next_entry"][i])
+        next_exit = restore(result["next_exit"][i])
+        batch_next = (next_entry, next_exit) if next_entry is not None else None
+
+        case = (entry_dt, exit_dt, start_dt, finish_dt)
+        assert write_attendance.format_status(int(result["status"][i]), int(result["minutes"][i])) == status, case
+        assert restore(result["exit"][i]) == new_exit_dt, case
+        assert batch_next == next_period_data, case
+
+
+@pytest.mark.parametrize("convert, restore", [(to_datetime64, from_datetime64), (to_epoch, from_epoch)],
+                         ids=["datetime64", "epoch"])
+def test_boundary_cases_match_scalar(convert, restore):
+    assert_matches_scalar(boundary_cases(), convert, restore)
+
+
+@pytest.mark.parametrize("convert, restore", [(to_datetime64, from_datetime64), (to_epoch, from_epoch)],
+                         ids=["datetime64", "epoch"])
+def test_random_cases_match_scalar(convert, restore):
+    assert_matches_scalar(random_cases(5000, seed=1), convert, restore)
+
+
+def test_time_arrays_keep_input_type():
+    start_dt, finish_dt = period_bounds(1)
+    case = [(start_dt, finish_dt + datetime.timedelta(minutes=30), start_dt, finish_dt)]
+
+    result = write_attendance.judge_attendance_batch(*(to_datetime64(column) for column in zip(*case)))
+    assert np.issubdtype(result["exit"].dtype, np.datetime64)
+
+    result = write_attendance.judge_attendance_batch(*(to_epoch(column) for column in zip(*case)))
+    assert result["exit"].dtype == np.int64
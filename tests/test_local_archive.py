@@ -0,0 +1,51 @@
+# commit_local_archive で保存したローカルアーカイブを iter_local_archive で読み戻せることを確認する
+import gzip
+import os
+
+import attendance_storage_write
+
+
+def write_archive(archive_dir, date_str, rows):
+    tmp_path, archive_file, writer = attendance_storage_write.open_local_archive(date_str, archive_dir)
+    for row in rows:
+        writer.writerow(row)
+    archive_file.close()
+    attendance_storage_write.commit_local_archive(tmp_path)
+
+
+def test_round_trip_single_day(tmp_path):
+    rows = [["S001", "2025-01-06 08:45:00", "x"], ["S002", "", ""]]
+    write_archive(str(tmp_path), "2025-01-06", rows)
+
+    assert not os.path.exists(attendance_storage_write.local_archive_path("2025-01-06", str(tmp_path)) + ".partial")
+    assert list(attendance_storage_write.iter_local_archive("2025-01-06", "2025-01-06", str(tmp_path))) == [
+        ("2025-01-06", row) for row in rows
+    ]
+
+
+def test_round_trip_appends_gzip_members_for_the_same_day(tmp_path):
+    first_rows = [["S001", "2025-01-06 08:45:00", "x"]]
+    second_rows = [["S002", "2025-01-06 10:25:00", "y"], ["S003", "", ""]]
+    write_archive(str(tmp_path), "2025-01-06", first_rows)
+    write_archive(str(tmp_path), "2025-01-06", second_rows)
+
+    # 2回目の保存は既存のファイルを書き換えず、2つ目の gzip メンバーとして追記される
+    path = attendance_storage_write.local_archive_path("2025-01-06", str(tmp_path))
+    with open(path, "rb") as f:
+        assert f.read().count(b"\x1f\x8b\x08") >= 2
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert f.read().count(",".join(attendance_storage_write.build_header_row())) == 2
+
+    assert list(attendance_storage_write.iter_local_archive("2025-01-06", "2025-01-06", str(tmp_path))) == [
+        ("2025-01-06", row) for row in first_rows + second_rows
+    ]
+
+
+def test_iter_local_archive_filters_by_date_across_years(tmp_path):
+    for date_str in ("2024-12-30", "2024-12-31", "2025-01-06", "2025-01-07"):
+        write_archive(str(tmp_path), date_str, [[f"S-{date_str}"]])
+
+    dates = [date_str for date_str, _ in attendance_storage_write.iter_local_archive(
+        "2024-12-31", "2025-01-06", str(tmp_path)
+    )]
+    assert dates == ["2024-12-31", "2025-01-06"]
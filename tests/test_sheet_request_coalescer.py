@@ -0,0 +1,65 @@
+# 実際の1か月分のシート作成リクエストを coalesce_requests に通し、結果を変えずに件数が減ることを確認する
+import pytest
+
+import write_class_schedule
+import write_course_schedule
+import write_schedule
+from month_calendar import get_month_calendar
+from sheet_request_coalescer import coalesce_requests
+
+SHEET_ID = 202503
+
+
+def schedule_requests():
+    return write_schedule.build_layout_requests(SHEET_ID, ["国語", "数学", "英語"]) + write_schedule.build_month_requests(
+        SHEET_ID, get_month_calendar(2025, 3)
+    )
+
+
+def class_schedule_requests():
+    return write_class_schedule.build_layout_requests(
+        SHEET_ID, ["学生A", "学生B"], ["1", "2"]
+    ) + write_class_schedule.build_month_requests(SHEET_ID, get_month_calendar(2025, 3))
+
+
+def course_schedule_requests():
+    return write_course_schedule.build_layout_requests(
+        SHEET_ID, ["学生A", "学生B"], ["1", "2"]
+    ) + write_course_schedule.build_month_requests(SHEET_ID, get_month_calendar(2025, 3))
+
+
+def written_values(requests):
+    """
+    updateCells で書き込まれる {(sheetId, row, col): CellData} を返す（後のリクエストが優先）。
+    """
+    values = {}
+    for request in requests:
+        update = request.get("updateCells")
+        if not update:
+            continue
+        start = update["start"]
+        for row_offset, row in enumerate(update["rows"]):
+            for col_offset, cell in enumerate(row["values"]):
+                key = (start["sheetId"], start["rowIndex"] + row_offset, start["columnIndex"] + col_offset)
+                values[key] = cell
+    return values
+
+
+def other_requests(requests):
+    return [request for request in requests if "updateCells" not in request]
+
+
+@pytest.mark.parametrize(
+    "build_requests",
+    [schedule_requests, class_schedule_requests, course_schedule_requests],
+    ids=["write_schedule", "write_class_schedule", "write_course_schedule"],
+)
+def test_real_month_requests_are_coalesced(build_requests):
+    requests = build_requests()
+
+    coalesced = coalesce_requests(requests)
+
+    assert len(coalesced) < len(requests)
+    # 書き込む値と、値以外のリクエスト (書式・列幅など) の内容・順序は変わらない
+    assert written_values(coalesced) == written_values(requests)
+    assert other_requests(coalesced) == other_requests(requests)
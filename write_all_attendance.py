@@ -0,0 +1,268 @@
+import datetime
+import sys
+from zoneinfo import ZoneInfo
+import gspread
+from write_attendance import (
+    ATTENDANCE_PATH,
+    JUDGED_HASH_PATH,
+    build_course_index,
+    build_student_sheet_cells,
+    flush_updates_to_firebase,
+    get_data_from_firebase,
+    initialize_clients,
+    judge_students,
+    select_judged_hash_updates,
+)
+from write_class_attendance import (
+    RateLimiter,
+    SHEETS_REQUESTS_PER_MINUTE,
+    get_list_or_dict_item,
+    get_period_from_now,
+    map_date_period_to_column,
+    parse_course_ids,
+    parse_student_indices,
+)
+from write_course_attendance import get_student_indices, map_date_to_column
+
+
+# ---------------------
+# write_attendance.py / write_course_attendance.py / write_class_attendance.py を1回の実行にまとめる。
+# Firebase を1回だけ読み、判定も1回だけ行い、その結果から
+# 学生・コース・クラスの各シートのセルを作成してスプレッドシートごとに1回で書き込む。
+# ---------------------
+
+
+class SheetCellWriter:
+    """
+    スプレッドシートごと・シート名ごとにセルを集め、スプレッドシート1つにつき
+    1回の values.batchUpdate でまとめて書き込みます。
+    """
+
+    def __init__(self, client, rate_limiter):
+        self.client = client
+        self.rate_limiter = rate_limiter
+        # spreadsheet_id -> {"create_missing": bool, "tabs": {title: {(row, col): 値}}}
+        self.spreadsheets = {}
+
+    def set_cell(self, spreadsheet_id, title, row, col, value, create_missing=False):
+        entry = self.spreadsheets.setdefault(spreadsheet_id, {"create_missing": create_missing, "tabs": {}})
+        entry["tabs"].setdefault(title, {})[(row, col)] = value
+
+    def flush(self):
+        """
+        集めたセルを書き込み、書き込みに失敗したスプレッドシートIDの集合を返します。
+        """
+        failed_spreadsheet_ids = set()
+        for spreadsheet_id, entry in self.spreadsheets.items():
+            try:
+                self._flush_spreadsheet(spreadsheet_id, entry["tabs"], entry["create_missing"])
+            except Exception as e:
+                print(f"[Debug] Error writing spreadsheet {spreadsheet_id}: {e}")
+                failed_spreadsheet_ids.add(spreadsheet_id)
+        return failed_spreadsheet_ids
+
+    def _flush_spreadsheet(self, spreadsheet_id, tabs, create_missing):
+        self.rate_limiter.wait()
+        sh = self.client.open_by_key(spreadsheet_id)
+        self.rate_limiter.wait()
+        existing_titles = {ws.title for ws in sh.worksheets()}
+
+        data = []
+        for title, cells in tabs.items():
+            if title not in existing_titles:
+                if not create_missing:
+                    print(f"[Debug] Worksheet '{title}' not found in spreadsheet {spreadsheet_id}. Skipping.")
+                    continue
+                self.rate_limiter.wait()
+                sh.add_worksheet(title=title, rows=50, cols=50)
+            for (row, col), value in sorted(cells.items()):
+                data.append(
+                    {"range": f"'{title}'!{gspread.utils.rowcol_to_a1(row, col)}", "values": [[value]]}
+                )
+
+        if not data:
+            return
+        self.rate_limiter.wait()
+        sh.values_batch_update({"valueInputOption": "USER_ENTERED", "data": data})
+        print(f"[Debug] Wrote {len(data)} cells to spreadsheet {spreadsheet_id}.")
+
+
+def load_data():
+    """
+    3つの書き込み処理で共通に使う Firebase のノードを1回ずつ取得します。
+    """
+    return {
+        "courses": get_data_from_firebase("Courses/course_id") or [],
+        "student_info": get_data_from_firebase("Students/student_info") or {},
+        "enrollment": get_data_from_firebase("Students/enrollment") or {},
+        "attendance": get_data_from_firebase(ATTENDANCE_PATH) or {},
+        "classes": get_data_from_firebase("Classes/class_index") or {},
+        "judged_hashes": get_data_from_firebase(JUDGED_HASH_PATH) or {},
+    }
+
+
+def collect_decisions(data, results_by_student):
+    """
+    (student_index, course_id) -> decision を作成します。
+    Firebase 上の既存の判定に、今回の判定結果を上書きしたものを返します。
+    """
+    student_id_map = data["student_info"].get("student_id", {})
+    decisions = {}
+    for student_id, attendance in data["attendance"].items():
+        if not isinstance(attendance, dict):
+            continue
+        student_index = (student_id_map.get(student_id) or {}).get("student_index")
+        course_nodes = attendance.get("course_id")
+        if not student_index or not course_nodes:
+            continue
+        items = enumerate(course_nodes) if isinstance(course_nodes, list) else course_nodes.items()
+        for course_id, course_data in items:
+            if not isinstance(course_data, dict) or course_data.get("decision") is None:
+                continue
+            try:
+                decisions[(student_index, int(course_id))] = course_data["decision"]
+            except ValueError:
+                continue
+
+    for student_index, results in results_by_student.items():
+        for (_, _, cid_int), status in results.items():
+            decisions[(student_index, cid_int)] = status
+    return decisions
+
+
+def render_student_cells(writer, data, results_by_student):
+    """
+    学生ごとのシート（write_attendance.py と同じレイアウト）のセルを作成します。
+    戻り値は student_index -> 書き込み先のスプレッドシートID（書き込むものが無い学生は None）です。
+    """
+    student_index_data = data["student_info"].get("student_index", {})
+    enrollment_data_all = data["enrollment"].get("student_index", {})
+    sheet_ids_by_student = {}
+    for std_idx, std_result_items in results_by_student.items():
+        if not std_result_items:
+            sheet_ids_by_student[std_idx] = None
+            continue
+        sheet_id = (student_index_data.get(std_idx) or {}).get("sheet_id")
+        enroll_info = enrollment_data_all.get(std_idx)
+        if not sheet_id or not enroll_info or "course_id" not in enroll_info:
+            continue
+        enrolled_course_ids = [c.strip() for c in enroll_info["course_id"].split(",") if c.strip()]
+        cells_by_sheet = build_student_sheet_cells(std_result_items, enrolled_course_ids)
+        for yyyymm, cells in cells_by_sheet.items():
+            for row, col, value in cells:
+                writer.set_cell(sheet_id, yyyymm, row, col, value, create_missing=True)
+        sheet_ids_by_student[std_idx] = sheet_id
+    return sheet_ids_by_student
+
+
+def render_course_cells(writer, data, decisions, todays_courses, current_sheet_name, current_day_of_month):
+    """
+    コースごとのシート（write_course_attendance.py と同じレイアウト）のセルを作成します。
+    """
+    column = map_date_to_column(current_day_of_month)
+    enrollment_by_course = data["enrollment"].get("course_id")
+    for course_id in sorted(todays_courses):
+        course_info = get_list_or_dict_item(data["courses"], course_id) or {}
+        sheet_id = course_info.get("course_sheet_id")
+        enrollment = get_list_or_dict_item(enrollment_by_course, course_id)
+        if not sheet_id or not isinstance(enrollment, dict) or not enrollment.get("student_index"):
+            continue
+        for idx, student_idx in enumerate(get_student_indices(enrollment["student_index"]), start=1):
+            decision = decisions.get((student_idx, course_id))
+            if decision is not None:
+                writer.set_cell(sheet_id, current_sheet_name, idx + 1, column, decision)
+
+
+def render_class_cells(writer, data, decisions, now, current_sheet_name, current_day_of_month):
+    """
+    クラスごとのシート（write_class_attendance.py と同じレイアウト）のセルを作成します。
+    """
+    current_period = get_period_from_now(now)
+    if current_period is None:
+        print("[Debug] 現在の時刻はどの授業時間にも該当しないため、クラスシートは更新しません。")
+        return
+
+    student_index_data = data["student_info"].get("student_index", {})
+    for class_index, class_data in data["classes"].items():
+        class_sheet_id = (class_data or {}).get("class_sheet_id")
+        course_ids_str = (class_data or {}).get("course_id", "")
+        student_indices_str = (class_data or {}).get("student_index", "")
+        if not class_sheet_id or not course_ids_str or not student_indices_str:
+            print(f"[Debug] Class {class_index} has incomplete data. Skipping.")
+            continue
+        possible_course_ids = parse_course_ids(course_ids_str)
+
+        for idx, student_idx in enumerate(parse_student_indices(student_indices_str), start=1):
+            row_number = idx + 2
+            student_id = (student_index_data.get(student_idx) or {}).get("student_id")
+            attendance = data["attendance"].get(student_id) if student_id else None
+            if not attendance or "entry1" not in attendance:
+                continue
+
+            if "exit1" not in attendance:
+                col_number = map_date_period_to_column(current_day_of_month, current_period)
+                writer.set_cell(class_sheet_id, current_sheet_name, row_number, col_number, "〇")
+                continue
+
+            for cid in possible_course_ids:
+                course_info = get_list_or_dict_item(data["courses"], cid)
+                course_period = (course_info or {}).get("schedule", {}).get("period")
+                if not course_period:
+                    continue
+                col_number = map_date_period_to_column(current_day_of_month, course_period)
+                decision = decisions.get((student_idx, cid), "")
+                writer.set_cell(class_sheet_id, current_sheet_name, row_number, col_number, decision)
+
+
+def main(force=False):
+    now = datetime.datetime.now(ZoneInfo("Asia/Tokyo"))
+    current_day = now.strftime("%A")
+    current_sheet_name = now.strftime("%Y-%m")
+    current_day_of_month = now.day
+    print(f"[Debug] Now (JST): {now}")
+
+    # Firebase と gspread の認証は write_attendance.py の1回だけ行う
+    gclient = initialize_clients()
+
+    # 1. Firebase を1回だけ読む
+    data = load_data()
+    if not data["courses"] or not data["student_info"]:
+        print("[Debug] 必要なデータが不足しています。終了します。")
+        return
+
+    # 2. 判定を1回だけ行い、Firebase へまとめて反映する
+    courses_by_weekday, enrolled_by_student = build_course_index(
+        data["courses"], data["enrollment"].get("student_index", {})
+    )
+    todays_courses = courses_by_weekday.get(current_day, {})
+    results_by_student, firebase_updates, judged_hash_updates = judge_students(
+        data["attendance"],
+        data["student_info"],
+        enrolled_by_student,
+        todays_courses,
+        {} if force else data["judged_hashes"],
+    )
+    if firebase_updates:
+        flush_updates_to_firebase(firebase_updates)
+    decisions = collect_decisions(data, results_by_student)
+
+    # 3. 同じ判定結果から3種類のシートのセルを作成し、スプレッドシートごとに1回で書き込む
+    writer = SheetCellWriter(gclient, RateLimiter(SHEETS_REQUESTS_PER_MINUTE))
+    sheet_ids_by_student = render_student_cells(writer, data, results_by_student)
+    render_course_cells(writer, data, decisions, todays_courses, current_sheet_name, current_day_of_month)
+    render_class_cells(writer, data, decisions, now, current_sheet_name, current_day_of_month)
+    failed_spreadsheet_ids = writer.flush()
+
+    # 4. 学生シートへの書き込みが完了した学生の判定ハッシュだけを保存する
+    written_students = {
+        std_idx for std_idx, sheet_id in sheet_ids_by_student.items() if sheet_id not in failed_spreadsheet_ids
+    }
+    hash_updates = select_judged_hash_updates(judged_hash_updates, written_students)
+    if hash_updates:
+        flush_updates_to_firebase(hash_updates)
+
+    print("=== 出席判定＆学生・コース・クラスシート書き込み完了 ===")
+
+
+if __name__ == "__main__":
+    main(force="--force" in sys.argv)
@@ -1,58 +1,184 @@
 import datetime
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 import firebase_admin
 from firebase_admin import credentials, db
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
+from read_datetime import READ_DATETIME_FORMAT, format_read_datetime, parse_read_datetime
 
 # ---------------------
 # Firebase & GSpread初期化
 # ---------------------
-if not firebase_admin._apps:
-    print("[DEBUG] Firebase未初期化。credentials.Certificateを使用して初期化します...")
-    cred = credentials.Certificate("/tmp/firebase_service_account.json")  # ここは適宜書き換え
-    firebase_admin.initialize_app(
-        cred,
-        {
-            "databaseURL": "https://test-51ebc-default-rtdb.firebaseio.com/",  # ここは適宜書き換え
-        },
-    )
-else:
-    print("[DEBUG] Firebaseはすでに初期化済です。")
+# initialize_clients() で設定する（import しただけでは認証しない）
+gclient = None
+
 
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/drive",
-]
-print("[DEBUG] Google認証の設定を行います...")
-creds = ServiceAccountCredentials.from_json_keyfile_name("/tmp/gcp_service_account.json", scope)  # ここは適宜書き換え
-gclient = gspread.authorize(creds)
-print("[DEBUG] Google認証が完了しました。")
+def initialize_clients():
+    """
+    Firebase と gspread を初期化し、gspread クライアントを返す。
+    初期化済みの場合は再初期化しない（write_all_attendance.py から呼ぶ場合も1回だけ認証する）。
+    """
+    global gclient
+    if not firebase_admin._apps:
+        print("[DEBUG] Firebase未初期化。credentials.Certificateを使用して初期化します...")
+        cred = credentials.Certificate("/tmp/firebase_service_account.json")  # ここは適宜書き換え
+        firebase_admin.initialize_app(
+            cred,
+            {
+                "databaseURL": "https://test-51ebc-default-rtdb.firebaseio.com/",  # ここは適宜書き換え
+            },
+        )
+    else:
+        print("[DEBUG] Firebaseはすでに初期化済です。")
+
+    if gclient is None:
+        scope = [
+            "https://spreadsheets.google.com/feeds",
+            "https://www.googleapis.com/auth/drive",
+        ]
+        print("[DEBUG] Google認証の設定を行います...")
+        creds = ServiceAccountCredentials.from_json_keyfile_name("/tmp/gcp_service_account.json", scope)  # ここは適宜書き換え
+        gclient = gspread.authorize(creds)
+        print("[DEBUG] Google認証が完了しました。")
+    return gclient
+
+
+# ATTENDANCE_TRACE=1 のときだけ、取得データの全体をログに出す
+TRACE = os.environ.get("ATTENDANCE_TRACE") == "1"
+
+ATTENDANCE_PATH = "Students/attendance/student_id"
+# 学生ごとの個別取得を並列に行うスレッド数
+FIREBASE_FETCH_WORKERS = 8
+
+
+def describe_data(data):
+    """
+    ログ用に、取得データの件数だけを表す短い文字列を返す。
+    """
+    if isinstance(data, (dict, list)):
+        return f"{type(data).__name__} {len(data)}件"
+    return repr(data)
 
 
 def get_data_from_firebase(path):
     print(f"[DEBUG] get_data_from_firebase: {path}")
     ref = db.reference(path)
     data = ref.get()
-    print(f"[DEBUG]  -> 取得データ: {data}")
+    print(f"[DEBUG]  -> 取得データ: {describe_data(data)}")
+    if TRACE:
+        print(f"[TRACE]  -> 取得データ: {data}")
     return data
 
 
-def update_data_in_firebase(path, data_dict):
-    print(f"[DEBUG] update_data_in_firebase: {path} に {data_dict} をupdateします。")
-    ref = db.reference(path)
-    ref.update(data_dict)
+def fetch_children(path, keys, suffix=""):
+    """
+    path/{key}{suffix} を key ごとに並列で取得し、{key: 値} を返す（値が無いものは含めない）。
+    """
+    keys = list(keys)
+    print(f"[DEBUG] fetch_children: {path}/*{suffix} を {len(keys)} 件取得します。")
 
+    def fetch(key):
+        return key, db.reference(f"{path}/{key}{suffix}").get()
 
-def set_data_in_firebase(path, value):
-    print(f"[DEBUG] set_data_in_firebase: {path} に {value} をsetします。")
-    ref = db.reference(path)
-    ref.set(value)
+    with ThreadPoolExecutor(max_workers=FIREBASE_FETCH_WORKERS) as executor:
+        results = {key: value for key, value in executor.map(fetch, keys) if value is not None}
+    if TRACE:
+        print(f"[TRACE]  -> 取得データ: {results}")
+    return results
+
+
+def has_entry_on(att_dict, date_str):
+    """
+    entry1～entry4 のいずれかの read_datetime が date_str の日付かどうかを返す。
+    """
+    if not isinstance(att_dict, dict):
+        return False
+    for slot_idx in range(1, SLOT_COUNT + 1):
+        read_dt = (att_dict.get(f"entry{slot_idx}") or {}).get("read_datetime")
+        if isinstance(read_dt, str) and read_dt.startswith(date_str):
+            return True
+    return False
+
+
+def fetch_todays_attendance(date_str):
+    """
+    entry1～entry4 のいずれかの read_datetime が date_str の学生の attendance だけを取得する。
+    entry スロットごとに read_datetime の範囲クエリを行って結果をまとめる
+    （entry1 が前日・未記録で entry2 以降だけが当日の学生も含める）。
+    .indexOn が未設定などでクエリに失敗した場合は、全件を1回で取得して当日分だけを残す。
+    """
+    ref = db.reference(ATTENDANCE_PATH)
+    attendance_data = {}
+    try:
+        for slot_idx in range(1, SLOT_COUNT + 1):
+            data = (
+                ref.order_by_child(f"entry{slot_idx}/read_datetime")
+                .start_at(f"{date_str} 00:00:00")
+                .end_at(f"{date_str} 23:59:59")
+                .get()
+            )
+            print(f"[DEBUG] fetch_todays_attendance: entry{slot_idx} の範囲クエリで {len(data or {})} 件取得しました。")
+            attendance_data.update(data or {})
+        return attendance_data
+    except Exception as e:
+        print(f"[DEBUG] fetch_todays_attendance: 範囲クエリに失敗しました。全件取得に切り替えます。 {e}")
+
+    all_attendance = get_data_from_firebase(ATTENDANCE_PATH) or {}
+    return {
+        student_id: att_dict
+        for student_id, att_dict in all_attendance.items()
+        if has_entry_on(att_dict, date_str)
+    }
 
 
-def parse_datetime(dt_str, fmt="%Y-%m-%d %H:%M:%S"):
+def fetch_todays_data(date_str):
+    """
+    当日の入退室がある学生についてのみ、attendance / student_info / enrollment を取得し、
+    全件取得時と同じ形の (attendance_data, student_info_data, enrollment_data_all) を返す。
+    """
+    attendance_data = fetch_todays_attendance(date_str)
+    if not attendance_data:
+        return {}, {}, {}
+
+    student_id_map = fetch_children("Students/student_info/student_id", attendance_data)
+    student_indices = {
+        info.get("student_index")
+        for info in student_id_map.values()
+        if isinstance(info, dict) and info.get("student_index")
+    }
+    student_info_data = {
+        "student_id": student_id_map,
+        "student_index": fetch_children("Students/student_info/student_index", student_indices),
+    }
+    enrollment_data_all = fetch_children("Students/enrollment/student_index", student_indices)
+    return attendance_data, student_info_data, enrollment_data_all
+
+
+# 1回の multi-path update に含めるパス数の上限
+FIREBASE_UPDATE_CHUNK_SIZE = 500
+
+
+def flush_updates_to_firebase(updates, chunk_size=FIREBASE_UPDATE_CHUNK_SIZE):
+    """
+    {ルートからのパス: 値} の multi-path update を、chunk_size 件ずつまとめて送信する。
+    """
+    items = list(updates.items())
+    for start in range(0, len(items), chunk_size):
+        chunk = dict(items[start:start + chunk_size])
+        print(f"[DEBUG] flush_updates_to_firebase: {len(chunk)} 件のパスを一括updateします。")
+        db.reference().update(chunk)
+
+
+def parse_datetime(dt_str, fmt=READ_DATETIME_FORMAT):
     if not dt_str:
         return None
     try:
+        if fmt == READ_DATETIME_FORMAT:
+            return parse_read_datetime(dt_str)
         return datetime.datetime.strptime(dt_str, fmt)
     except Exception as e:
         print(f"[DEBUG] parse_datetime: 変換失敗 ({dt_str}) {e}")
@@ -163,72 +289,306 @@ def judge_attendance_for_period(entry_dt, exit_dt, start_dt, finish_dt):
     return "？", entry_dt, exit_dt, None
 
 
-def ensure_slot_is_free(att_dict, updates, slot_idx):
+# judge_attendance_batch が返すステータスコード
+STATUS_PRESENT = 0  # 〇
+STATUS_LATE = 1  # △遅{n}分
+STATUS_EARLY = 2  # △早{n}分
+STATUS_ABSENT = 3  # ×
+STATUS_UNKNOWN = 4  # ？
+
+
+def format_status(status_code, minutes):
     """
-    slot_idx番 (entry{slot_idx}/exit{slot_idx}) が既に使われている場合、
-    後ろ(最大4まで)へずらして空きを作り、実際に使えるスロット番号を返す。
+    judge_attendance_batch のステータスコードと分数を、
+    judge_attendance_for_period と同じ表示文字列に変換する。
+    """
+    if status_code == STATUS_LATE:
+        return f"△遅{minutes}分"
+    if status_code == STATUS_EARLY:
+        return f"△早{minutes}分"
+    return {STATUS_PRESENT: "〇", STATUS_ABSENT: "×"}.get(status_code, "？")
+
 
-    - ずらした内容も 'updates' に反映しておき、後で Firebase に update() する。
-    - 1日最大4スロット前提。
+def judge_attendance_batch(entry_ts, exit_ts, start_ts, finish_ts):
     """
-    if slot_idx > 4:
-        return 4
+    judge_attendance_for_period を配列単位でまとめて行うバッチ版（学期単位の再判定・監査用）。
 
-    ekey = f"entry{slot_idx}"
-    xkey = f"exit{slot_idx}"
+    引数はいずれも同じ長さの配列で、numpy.datetime64 または epoch 秒(int)を受け付ける。
+    入退室の欠損は NaT（int の場合は numpy.iinfo(numpy.int64).min）で表す。
 
-    # 空いていれば、そのスロットを返す
-    if (ekey not in att_dict) and (xkey not in att_dict):
-        return slot_idx
+    戻り値は dict:
+      - status: ステータスコード (STATUS_*)
+      - minutes: 遅刻/早退の分数（それ以外は 0）
+      - exit: 補正後の退室時刻（次コマへまたがる場合は授業終了時刻）
+      - next_entry, next_exit: 次コマ用の入退室時刻（無い場合は欠損値）
+    時刻の配列は入力と同じ形式（datetime64[s] または epoch 秒）で返す。
+    """
+    import numpy as np  # 監査用途のみで使うため、通常の実行では読み込まない
+
+    missing = np.iinfo(np.int64).min
+    is_datetime = np.issubdtype(np.asarray(entry_ts).dtype, np.datetime64)
+
+    def to_seconds(values):
+        values = np.asarray(values)
+        if np.issubdtype(values.dtype, np.datetime64):
+            return values.astype("datetime64[s]").astype(np.int64)
+        return values.astype(np.int64)
+
+    entry = to_seconds(entry_ts)
+    exit_ = to_seconds(exit_ts)
+    start = to_seconds(start_ts)
+    finish = to_seconds(finish_ts)
+
+    has_entry = entry != missing
+    has_exit = exit_ != missing
+    both = has_entry & has_exit
+    start_5 = start + 5 * 60
+    finish_minus_5 = finish - 5 * 60
+    finish_plus_5 = finish + 5 * 60
+
+    entry_only = has_entry & ~has_exit
+    entry_only_late = entry_only & (entry >= start_5)
+    absent = both & (entry >= finish)
+    on_time = both & (entry <= start_5)
+    early = on_time & (exit_ < finish_minus_5)
+    present = on_time & (exit_ <= finish_plus_5)
+    present_carry = on_time & (exit_ >= finish_plus_5)
+    late_carry = both & (entry >= start_5) & (exit_ >= finish_plus_5)
+    late = both & (entry > start_5) & (exit_ <= finish_plus_5)
+
+    # 条件は judge_attendance_for_period の if 文と同じ順序で評価する（先に一致したものを採用）
+    branch = np.select(
+        [entry_only_late, entry_only, absent, early, present, present_carry, late_carry, late],
+        [1, 2, 3, 4, 5, 6, 7, 8],
+        default=0,
+    )
 
-    # slot_idx=4 まで埋まっているなら、上書きするしかない
-    if slot_idx == 4:
-        return 4
+    status = np.full(entry.shape, STATUS_UNKNOWN, dtype=np.int8)
+    status[(branch == 2) | (branch == 5) | (branch == 6)] = STATUS_PRESENT
+    status[(branch == 1) | (branch == 7) | (branch == 8)] = STATUS_LATE
+    status[branch == 4] = STATUS_EARLY
+    status[branch == 3] = STATUS_ABSENT
 
-    # ここに来たなら、slot_idx < 4 かつ埋まっている
-    next_slot = ensure_slot_is_free(att_dict, updates, slot_idx + 1)
-    ekey_next = f"entry{next_slot}"
-    xkey_next = f"exit{next_slot}"
+    minutes = np.zeros(entry.shape, dtype=np.int64)
+    is_late = status == STATUS_LATE
+    minutes[is_late] = (entry[is_late] - start[is_late]) // 60
+    is_early = status == STATUS_EARLY
+    minutes[is_early] = (finish[is_early] - exit_[is_early]) // 60
 
-    # 現在のスロットにあるデータを next_slot に移動
-    if ekey in att_dict:
-        updates[ekey_next] = att_dict[ekey]
-        att_dict[ekey_next] = att_dict[ekey]
-        del att_dict[ekey]
-    if xkey in att_dict:
-        updates[xkey_next] = att_dict[xkey]
-        att_dict[xkey_next] = att_dict[xkey]
-        del att_dict[xkey]
+    carry = (branch == 6) | (branch == 7)
+    new_exit = np.where(carry, finish, exit_)
+    next_entry = np.where(carry, finish + 10 * 60, missing)
+    next_exit = np.where(carry, exit_, missing)
 
-    # この slot_idx が空いたので、それを返す
-    return slot_idx
+    def from_seconds(values):
+        if is_datetime:
+            return values.astype("datetime64[s]")
+        return values
 
+    return {
+        "status": status,
+        "minutes": minutes,
+        "exit": from_seconds(new_exit),
+        "next_entry": from_seconds(next_entry),
+        "next_exit": from_seconds(next_exit),
+    }
 
-def process_attendance_and_write_sheet():
-    now = datetime.datetime.now()
-    current_weekday_str = now.strftime("%A")
-    print(f"[DEBUG] 現在の曜日: {current_weekday_str}")
 
-    print("[DEBUG] attendance_data を取得します。")
-    attendance_data = get_data_from_firebase("Students/attendance/student_id")
-    if not attendance_data:
-        print("attendance データがありません。終了します。")
-        return
+# 1日あたりの entry/exit スロット数
+SLOT_COUNT = 4
 
-    print("[DEBUG] Courses/course_id を取得します。")
-    courses_all = get_data_from_firebase("Courses/course_id")
 
-    print("[DEBUG] Students/student_info を取得します。")
-    student_info_data = get_data_from_firebase("Students/student_info")
+class AttendanceSlots:
+    """
+    1学生分の entry1～4 / exit1～4 を固定長の配列で保持する。
+    判定中の補正はこの配列上で行い、学生の処理が終わった時点で
+    読み込み時からの差分だけを Firebase の更新パスとして取り出す。
+    """
 
-    print("[DEBUG] Students/enrollment/student_index を取得します。")
-    enrollment_data_all = get_data_from_firebase("Students/enrollment/student_index")
+    __slots__ = ("entries", "exits", "_original_entries", "_original_exits")
 
-    if not courses_all or not student_info_data or not enrollment_data_all:
-        print("[DEBUG] 必要なデータが不足しています。終了します。")
+    def __init__(self, att_dict):
+        self.entries = [att_dict.get(f"entry{i}") for i in range(1, SLOT_COUNT + 1)]
+        self.exits = [att_dict.get(f"exit{i}") for i in range(1, SLOT_COUNT + 1)]
+        self._original_entries = list(self.entries)
+        self._original_exits = list(self.exits)
+
+    def entry(self, slot_idx):
+        if 1 <= slot_idx <= SLOT_COUNT:
+            return self.entries[slot_idx - 1]
+        return None
+
+    def exit(self, slot_idx):
+        if 1 <= slot_idx <= SLOT_COUNT:
+            return self.exits[slot_idx - 1]
+        return None
+
+    def set_entry(self, slot_idx, value):
+        self.entries[slot_idx - 1] = value
+
+    def set_exit(self, slot_idx, value):
+        self.exits[slot_idx - 1] = value
+
+    def make_room(self, slot_idx):
+        """
+        slot_idx番が既に使われている場合、後ろ(最大4まで)へずらして空きを作り、
+        実際に使えるスロット番号を返す。
+        - 最初の空きスロットまでを1つずつ後ろへずらす（空きが無ければ4番を上書き）。
+        """
+        if slot_idx > SLOT_COUNT:
+            return SLOT_COUNT
+
+        i = slot_idx - 1
+        entries, exits = self.entries, self.exits
+
+        # 空いていれば、そのスロットを返す
+        if entries[i] is None and exits[i] is None:
+            return slot_idx
+
+        # slot_idx=4 まで埋まっているなら、上書きするしかない
+        if slot_idx == SLOT_COUNT:
+            return SLOT_COUNT
+
+        # 後ろ側で最初の空きスロット（無ければ最後のスロット）を探す
+        free = i + 1
+        while free < SLOT_COUNT - 1 and (entries[free] is not None or exits[free] is not None):
+            free += 1
+
+        # 後ろから順に、存在するデータだけを1つ後ろへ移動
+        for k in range(free - 1, i - 1, -1):
+            if entries[k] is not None:
+                entries[k + 1] = entries[k]
+                entries[k] = None
+            if exits[k] is not None:
+                exits[k + 1] = exits[k]
+                exits[k] = None
+
+        return slot_idx
+
+    def content_hash(self, valid_course_list):
+        """
+        スロットの内容と当日の対象コース一覧から、判定入力のハッシュ値を返す。
+        """
+        payload = json.dumps(
+            [self.entries, self.exits, valid_course_list], sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def to_firebase_updates(self, att_path):
+        """
+        読み込み時から変化したスロットだけを {パス: 値} で返す（削除は None）。
+        """
+        updates = {}
+        for i in range(SLOT_COUNT):
+            if self.entries[i] != self._original_entries[i]:
+                updates[f"{att_path}/entry{i + 1}"] = self.entries[i]
+            if self.exits[i] != self._original_exits[i]:
+                updates[f"{att_path}/exit{i + 1}"] = self.exits[i]
+        return updates
+
+
+def build_course_index(courses_all, enrollment_data_all):
+    """
+    1回の実行につき1度だけ呼び、判定ループで使う索引を作成する。
+    - courses_by_weekday: 曜日 -> {course_id: period}
+    - enrolled_by_student: student_index -> 履修 course_id(int) の集合
+    """
+    courses_by_weekday = {}
+    for cid_int, course_info in enumerate(courses_all):
+        if not course_info:
+            continue
+        sched = course_info.get("schedule", {})
+        day_in_course = sched.get("day", "")
+        period_in_course = sched.get("period", 0)
+        courses_by_weekday.setdefault(day_in_course, {})[cid_int] = period_in_course
+
+    enrolled_by_student = {}
+    for student_index, enroll_info in enrollment_data_all.items():
+        if not enroll_info or "course_id" not in enroll_info:
+            continue
+        enrolled_ids = set()
+        for cid_str in enroll_info["course_id"].split(","):
+            try:
+                enrolled_ids.add(int(cid_str.strip()))
+            except ValueError:
+                continue
+        enrolled_by_student[student_index] = enrolled_ids
+
+    return courses_by_weekday, enrolled_by_student
+
+
+def write_cells_to_spreadsheet(sh, cells_by_sheet):
+    """
+    シート名ごとの (row, col, 値) の一覧を、1回の values.batchUpdate でまとめて書き込む。
+    存在しないシートは事前に作成する。
+    """
+    existing_titles = {ws.title for ws in sh.worksheets()}
+    data = []
+    for yyyymm, cells in cells_by_sheet.items():
+        # 該当シートが無ければ新規作成
+        if yyyymm not in existing_titles:
+            sh.add_worksheet(title=yyyymm, rows=50, cols=50)
+            existing_titles.add(yyyymm)
+
+        for row, col, value in cells:
+            data.append(
+                {
+                    "range": f"'{yyyymm}'!{gspread.utils.rowcol_to_a1(row, col)}",
+                    "values": [[value]],
+                }
+            )
+
+    if not data:
         return
 
-    results_dict = {}
+    print(f"[DEBUG] {len(data)} セルを一括で書き込みます: sheet_id={sh.id}")
+    sh.values_batch_update({"valueInputOption": "USER_ENTERED", "data": data})
+
+
+def build_student_sheet_cells(std_result_items, enrolled_course_ids):
+    """
+    1学生分の判定結果から、シート名(YYYY-MM)ごとの (row, col, 値) の一覧を作成する。
+    """
+    cells_by_sheet = {}
+    for (new_course_idx, date_str, cid_int), status_val in std_result_items.items():
+        yyyymm = date_str[:7]  # "YYYY-MM"
+        day = int(date_str[8:10])  # "dd"
+
+        cid_str = str(cid_int)
+        try:
+            course_pos = enrolled_course_ids.index(cid_str)
+        except ValueError:
+            continue
+
+        # 例として、行: コース順+2, 列: 日付+1 に更新
+        row = course_pos + 2
+        col = day + 1
+        cells_by_sheet.setdefault(yyyymm, []).append((row, col, status_val))
+
+    return cells_by_sheet
+
+
+# 学生ごとに、最後に判定した時点の入力ハッシュを保存するパス
+JUDGED_HASH_PATH = "Students/attendance/judged_hash"
+
+
+def judge_students(attendance_data, student_info_data, enrolled_by_student, todays_courses, judged_hashes):
+    """
+    学生ごとに当日の出席判定を行う（Firebase やシートへの書き込みは行わない）。
+    戻り値:
+      - results_by_student: student_index -> {(new_course_idx, date_str, cid_int): status}
+      - firebase_updates: 判定結果・スロット補正の {ルートからのパス: 値}
+      - judged_hash_updates: student_index -> 判定ハッシュの {ルートからのパス: 値}
+        （シートへの書き込みが成功した学生の分だけ、後から select_judged_hash_updates で反映する）
+    """
+    todays_course_ids = set(todays_courses)
+
+    # student_index -> {(new_course_idx, date_str, cid_int): status}
+    results_by_student = {}
+    # 判定結果とスロット補正を、最後に1回の multi-path update で反映する
+    firebase_updates = {}
+    # 判定ハッシュはシート書き込みの成否が分かるまで保存しない
+    judged_hash_updates = {}
 
     print("[DEBUG] === 学生ごとのループを開始します。 ===")
     for student_id, att_dict in attendance_data.items():
@@ -244,46 +604,30 @@ def process_attendance_and_write_sheet():
         if not student_index:
             continue
 
-        # enrollment (course_id一覧)
-        enroll_info = enrollment_data_all.get(student_index)
-        if not enroll_info or "course_id" not in enroll_info:
+        # enrollment (course_id集合)
+        enrolled_ids = enrolled_by_student.get(student_index)
+        if enrolled_ids is None:
             continue
+        print(f"[DEBUG] student_index={student_index} が履修しているコース: {sorted(enrolled_ids)}")
 
-        enrolled_course_str = enroll_info["course_id"]
-        enrolled_course_ids = [c.strip() for c in enrolled_course_str.split(",") if c.strip()]
-        print(f"[DEBUG] student_index={student_index} が履修しているコース: {enrolled_course_ids}")
-
-        # 今日の曜日と合致するコースを抽出し、(period, course_id) でソート
-        valid_course_list = []
-        for cid_str in enrolled_course_ids:
-            try:
-                cid_int = int(cid_str)
-            except ValueError:
-                continue
-            if cid_int < 0 or cid_int >= len(courses_all):
-                continue
-
-            course_info = courses_all[cid_int]
-            if not course_info:
-                continue
+        # 今日の曜日と合致するコースを抽出し、periodが小さい順、同じなら course_id が小さい順にソート
+        valid_course_list = sorted(
+            (todays_courses[cid_int], cid_int) for cid_int in enrolled_ids & todays_course_ids
+        )
+        print(f"[DEBUG] => 当日対象のコース一覧(sorted): {valid_course_list}")
 
-            sched = course_info.get("schedule", {})
-            day_in_course = sched.get("day", "")
-            period_in_course = sched.get("period", 0)
-            # 今日の曜日と合致するコースのみ
-            if day_in_course == current_weekday_str:
-                valid_course_list.append((period_in_course, cid_int))
+        slots = AttendanceSlots(att_dict)
 
-        # periodが小さい順、同じなら course_id が小さい順にソート
-        valid_course_list.sort(key=lambda x: (x[0], x[1]))
-        print(f"[DEBUG] => 当日対象のコース一覧(sorted): {valid_course_list}")
+        # 前回判定時から入力が変わっていなければスキップ
+        if judged_hashes.get(student_id) == slots.content_hash(valid_course_list):
+            print(f"[DEBUG] student_id={student_id} は前回の判定から変更が無いためスキップ")
+            continue
 
         # 基準日 (最初に見つかった entry1～entry4 の read_datetime の日付)
         base_date = None
-        for i in range(1, 5):
-            ekey_test = f"entry{i}"
-            if ekey_test in att_dict:
-                dt_tmp = parse_datetime(att_dict[ekey_test].get("read_datetime", ""))
+        for entry_test in slots.entries:
+            if entry_test is not None:
+                dt_tmp = parse_datetime(entry_test.get("read_datetime", ""))
                 if dt_tmp:
                     base_date = dt_tmp.date()
                     break
@@ -295,6 +639,8 @@ def process_attendance_and_write_sheet():
         date_str = base_date.strftime("%Y-%m-%d")
         print(f"[DEBUG] => student_id={student_id} / 基準日: {date_str}")
 
+        student_results = results_by_student.setdefault(student_index, {})
+
         # 前のperiodで entry はあるが exit が無い場合、以降のperiodは判定せず特定の値（ここでは空文字列）を設定するフラグ
         incomplete_previous = False
 
@@ -303,30 +649,28 @@ def process_attendance_and_write_sheet():
             if not (1 <= schedule_period <= 4):
                 continue
 
-            ekey = f"entry{new_course_idx}"
-            xkey = f"exit{new_course_idx}"
-            print(f"[DEBUG] => course_id={cid_int}, period={schedule_period} -> ekey={ekey}, xkey={xkey}")
+            print(f"[DEBUG] => course_id={cid_int}, period={schedule_period} -> slot={new_course_idx}")
 
             # 前のperiodで exit が未記録の場合は、このperiodはスキップして特定の値を設定
             if incomplete_previous:
                 print(f"[DEBUG] 以前のperiodで exit が未記録のため、course_id={cid_int} の判定は空文字列に設定")
                 decision_path = f"Students/attendance/student_id/{student_id}/course_id/{cid_int}/decision"
                 # Firebase は None を受け付けないので、ここでは空文字列 "" をセットする
-                set_data_in_firebase(decision_path, "")
-                results_dict[(student_index, new_course_idx, date_str, cid_int)] = ""
+                firebase_updates[decision_path] = ""
+                student_results[(new_course_idx, date_str, cid_int)] = ""
                 continue
 
             # entryが存在しなければ欠席扱い
-            if ekey not in att_dict:
-                print(f"[DEBUG] {ekey} が無いので欠席(×)")
+            entry_info = slots.entry(new_course_idx)
+            if entry_info is None:
+                print(f"[DEBUG] entry{new_course_idx} が無いので欠席(×)")
                 status = "×"
                 decision_path = f"Students/attendance/student_id/{student_id}/course_id/{cid_int}/decision"
-                set_data_in_firebase(decision_path, status)
-                results_dict[(student_index, new_course_idx, date_str, cid_int)] = status
+                firebase_updates[decision_path] = status
+                student_results[(new_course_idx, date_str, cid_int)] = status
                 continue
 
-            entry_info = att_dict[ekey]
-            exit_info = att_dict.get(xkey, {})
+            exit_info = slots.exit(new_course_idx) or {}
             entry_dt = parse_datetime(entry_info.get("read_datetime", ""))
             exit_dt = parse_datetime(exit_info.get("read_datetime", ""))
 
@@ -346,79 +690,134 @@ def process_attendance_and_write_sheet():
             if entry_dt and (exit_dt is None):
                 incomplete_previous = True
 
-            updates = {}
-
             # 入室時刻の補正
             if new_entry_dt and (new_entry_dt != entry_dt):
-                updates[ekey] = {
-                    "read_datetime": new_entry_dt.strftime("%Y-%m-%d %H:%M:%S"),
+                slots.set_entry(new_course_idx, {
+                    "read_datetime": format_read_datetime(new_entry_dt),
                     "serial_number": entry_info.get("serial_number", ""),
-                }
-                att_dict[ekey] = updates[ekey]
+                })
 
             # 退出時刻の補正
-            if new_exit_dt and (new_exit_dt != exit_dt):
-                updates[xkey] = {
-                    "read_datetime": new_exit_dt.strftime("%Y-%m-%d %H:%M:%S"),
+            if new_exit_dt and (new_exit_dt != exit_dt or not exit_dt):
+                slots.set_exit(new_course_idx, {
+                    "read_datetime": format_read_datetime(new_exit_dt),
                     "serial_number": exit_info.get("serial_number", ""),
-                }
-                att_dict[xkey] = updates[xkey]
-            elif new_exit_dt and not exit_dt:
-                updates[xkey] = {
-                    "read_datetime": new_exit_dt.strftime("%Y-%m-%d %H:%M:%S"),
-                    "serial_number": exit_info.get("serial_number", ""),
-                }
-                att_dict[xkey] = updates[xkey]
+                })
 
             # 次コマへまたがる場合
-            if next_period_data and new_course_idx < 4:
-                slot_for_next = ensure_slot_is_free(att_dict, updates, new_course_idx + 1)
-                next_ekey = f"entry{slot_for_next}"
-                next_xkey = f"exit{slot_for_next}"
+            if next_period_data and new_course_idx < SLOT_COUNT:
+                slot_for_next = slots.make_room(new_course_idx + 1)
                 print(f"[DEBUG] 次コマデータを slot={slot_for_next} に書き込み")
                 next_e, next_x = next_period_data
                 if next_e:
-                    updates[next_ekey] = {
-                        "read_datetime": next_e.strftime("%Y-%m-%d %H:%M:%S"),
+                    slots.set_entry(slot_for_next, {
+                        "read_datetime": format_read_datetime(next_e),
                         "serial_number": entry_info.get("serial_number", ""),
-                    }
-                    att_dict[next_ekey] = updates[next_ekey]
+                    })
                 if next_x:
-                    updates[next_xkey] = {
-                        "read_datetime": next_x.strftime("%Y-%m-%d %H:%M:%S"),
+                    slots.set_exit(slot_for_next, {
+                        "read_datetime": format_read_datetime(next_x),
                         "serial_number": exit_info.get("serial_number", ""),
-                    }
-                    att_dict[next_xkey] = updates[next_xkey]
-
-            # Firebase への更新
-            if updates:
-                att_path = f"Students/attendance/student_id/{student_id}"
-                update_data_in_firebase(att_path, updates)
+                    })
 
             decision_path = f"Students/attendance/student_id/{student_id}/course_id/{cid_int}/decision"
-            set_data_in_firebase(decision_path, status)
-            results_dict[(student_index, new_course_idx, date_str, cid_int)] = status
+            firebase_updates[decision_path] = status
+            student_results[(new_course_idx, date_str, cid_int)] = status
+
+        # 学生ごとの処理が終わった時点で、スロットの差分だけを反映対象に加える
+        firebase_updates.update(slots.to_firebase_updates(f"Students/attendance/student_id/{student_id}"))
+        # 判定後の内容のハッシュを保存し、次回の実行で変更の有無を判断する
+        judged_hash_updates.setdefault(student_index, {})[f"{JUDGED_HASH_PATH}/{student_id}"] = (
+            slots.content_hash(valid_course_list)
+        )
+
+    return results_by_student, firebase_updates, judged_hash_updates
+
+
+def select_judged_hash_updates(judged_hash_updates, written_students):
+    """
+    シートへの書き込みが完了した（または書き込むものが無かった）学生の判定ハッシュだけを
+    {ルートからのパス: 値} にまとめて返す。書き込みに失敗した学生は次回の実行で再判定される。
+    """
+    updates = {}
+    for student_index in written_students:
+        updates.update(judged_hash_updates.get(student_index, {}))
+    return updates
+
+
+def process_attendance_and_write_sheet(force=False, full_fetch=False):
+    """
+    当日の出席判定を行い、結果を Firebase と各学生のシートに書き込む。
+    前回の判定以降に入退室データが変わっていない学生はスキップする（force=True で全員を再判定）。
+    通常は当日の入退室がある学生のデータのみ取得する（full_fetch=True で全件取得）。
+    """
+    initialize_clients()
+    now = datetime.datetime.now()
+    current_weekday_str = now.strftime("%A")
+    print(f"[DEBUG] 現在の曜日: {current_weekday_str}")
+
+    if full_fetch:
+        print("[DEBUG] attendance_data を取得します。")
+        attendance_data = get_data_from_firebase(ATTENDANCE_PATH)
+    else:
+        print(f"[DEBUG] {now.date()} の入退室がある学生のデータのみ取得します。")
+        attendance_data, student_info_data, enrollment_data_all = fetch_todays_data(
+            now.strftime("%Y-%m-%d")
+        )
+    if not attendance_data:
+        print("attendance データがありません。終了します。")
+        return
+
+    print("[DEBUG] Courses/course_id を取得します。")
+    courses_all = get_data_from_firebase("Courses/course_id")
+
+    if full_fetch:
+        print("[DEBUG] Students/student_info を取得します。")
+        student_info_data = get_data_from_firebase("Students/student_info")
+
+        print("[DEBUG] Students/enrollment/student_index を取得します。")
+        enrollment_data_all = get_data_from_firebase("Students/enrollment/student_index")
+
+    if not courses_all or not student_info_data or not enrollment_data_all:
+        print("[DEBUG] 必要なデータが不足しています。終了します。")
+        return
+
+    if force:
+        judged_hashes = {}
+    elif full_fetch:
+        judged_hashes = get_data_from_firebase(JUDGED_HASH_PATH) or {}
+    else:
+        judged_hashes = fetch_children(JUDGED_HASH_PATH, attendance_data)
+
+    courses_by_weekday, enrolled_by_student = build_course_index(courses_all, enrollment_data_all)
+    todays_courses = courses_by_weekday.get(current_weekday_str, {})
+    print(f"[DEBUG] 本日({current_weekday_str})のコース: {sorted(todays_courses)}")
+
+    # student_index -> {(new_course_idx, date_str, cid_int): status}
+    # 判定結果とスロット補正は、最後に1回の multi-path update で反映する
+    results_by_student, firebase_updates, judged_hash_updates = judge_students(
+        attendance_data, student_info_data, enrolled_by_student, todays_courses, judged_hashes
+    )
+
+    if firebase_updates:
+        flush_updates_to_firebase(firebase_updates)
 
     print("[DEBUG] === シート書き込み処理を開始します。 ===")
     all_student_index_data = student_info_data.get("student_index", {})
-    for std_idx, info_val in all_student_index_data.items():
+    # シートへの書き込みが完了した（または書き込むものが無い）学生
+    written_students = set()
+    # 結果がある学生のシートのみ開く
+    for std_idx, std_result_items in results_by_student.items():
+        if not std_result_items:
+            written_students.add(std_idx)
+            continue
+
+        info_val = all_student_index_data.get(std_idx) or {}
         sheet_id = info_val.get("sheet_id")
         if not sheet_id:
             print(f"[DEBUG] student_index={std_idx} に sheet_id がありません。スキップ。")
             continue
 
-        try:
-            print(f"[DEBUG] Google SpreadSheetを開きます: sheet_id={sheet_id}")
-            sh = gclient.open_by_key(sheet_id)
-        except Exception as e:
-            print(f"[DEBUG] シートを開けませんでした。例外: {e}")
-            continue
-
-        # 結果を書き込む対象のみ抽出
-        std_result_items = {k: v for k, v in results_dict.items() if k[0] == std_idx}
-        if not std_result_items:
-            continue
-
         # enrollment情報から、この学生が履修しているcourse_id一覧を取得
         enroll_info = enrollment_data_all.get(std_idx)
         if not enroll_info or "course_id" not in enroll_info:
@@ -427,29 +826,28 @@ def process_attendance_and_write_sheet():
         enrolled_course_str = enroll_info["course_id"]
         enrolled_course_ids = [c.strip() for c in enrolled_course_str.split(",") if c.strip()]
 
-        for (s_idx, new_course_idx, date_str, cid_int), status_val in std_result_items.items():
-            yyyymm = date_str[:7]  # "YYYY-MM"
-            day = int(date_str[8:10])  # "dd"
-
-            # 該当シートを開く or 新規作成
-            try:
-                ws = sh.worksheet(yyyymm)
-            except gspread.exceptions.WorksheetNotFound:
-                ws = sh.add_worksheet(title=yyyymm, rows=50, cols=50)
+        try:
+            print(f"[DEBUG] Google SpreadSheetを開きます: sheet_id={sheet_id}")
+            sh = gclient.open_by_key(sheet_id)
+        except Exception as e:
+            print(f"[DEBUG] シートを開けませんでした。例外: {e}")
+            continue
 
-            cid_str = str(cid_int)
-            try:
-                course_pos = enrolled_course_ids.index(cid_str)
-            except ValueError:
-                continue
+        cells_by_sheet = build_student_sheet_cells(std_result_items, enrolled_course_ids)
+        try:
+            write_cells_to_spreadsheet(sh, cells_by_sheet)
+        except Exception as e:
+            print(f"[DEBUG] シートへの書き込みに失敗しました: sheet_id={sheet_id} 例外: {e}")
+            continue
+        written_students.add(std_idx)
 
-            # 例として、行: コース順+2, 列: 日付+1 に更新
-            row = course_pos + 2
-            col = day + 1
-            ws.update_cell(row, col, status_val)
+    # シートへの書き込みが完了した学生の判定ハッシュだけを保存する
+    hash_updates = select_judged_hash_updates(judged_hash_updates, written_students)
+    if hash_updates:
+        flush_updates_to_firebase(hash_updates)
 
     print("=== 出席判定処理＆シート書き込み完了 ===")
 
 
 if __name__ == "__main__":
-    process_attendance_and_write_sheet()
+    process_attendance_and_write_sheet(force="--force" in sys.argv, full_fetch="--full" in sys.argv)
@@ -1,4 +1,7 @@
 import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from zoneinfo import ZoneInfo
 import firebase_admin
 from firebase_admin import credentials, db
@@ -9,20 +12,79 @@ from oauth2client.service_account import ServiceAccountCredentials
 # ---------------------
 # Firebase & GSpread 初期化
 # ---------------------
-if not firebase_admin._apps:
-    cred = credentials.Certificate("/tmp/firebase_service_account.json")
-    firebase_admin.initialize_app(
-        cred, {"databaseURL": "https://test-51ebc-default-rtdb.firebaseio.com/"}
-    )
-    print("[Debug] Firebase initialized.")
-
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/drive",
-]
-creds = ServiceAccountCredentials.from_json_keyfile_name("/tmp/gcp_service_account.json", scope)
-gclient = gspread.authorize(creds)
-print("[Debug] Google Sheets API authorized.")
+# initialize_clients() で設定する（import しただけでは認証しない）
+creds = None
+gclient = None
+
+
+def initialize_clients():
+    """
+    Firebase と gspread を初期化します。初期化済みの場合は再初期化しません。
+    """
+    global creds, gclient
+    if not firebase_admin._apps:
+        cred = credentials.Certificate("/tmp/firebase_service_account.json")
+        firebase_admin.initialize_app(
+            cred, {"databaseURL": "https://test-51ebc-default-rtdb.firebaseio.com/"}
+        )
+        print("[Debug] Firebase initialized.")
+
+    if gclient is None:
+        scope = [
+            "https://spreadsheets.google.com/feeds",
+            "https://www.googleapis.com/auth/drive",
+        ]
+        creds = ServiceAccountCredentials.from_json_keyfile_name("/tmp/gcp_service_account.json", scope)
+        gclient = gspread.authorize(creds)
+        print("[Debug] Google Sheets API authorized.")
+
+# クラスを並列に処理するときの最大スレッド数（1 なら逐次処理）
+MAX_CLASS_WORKERS = 4
+# 全スレッド合計での Sheets API 呼び出し上限（1分あたり）
+SHEETS_REQUESTS_PER_MINUTE = 50
+
+
+class RateLimiter:
+    """
+    全スレッド共通のトークンバケット型レートリミッタ。
+    1分あたり requests_per_minute 回までの呼び出しを許可し、上限を超える分だけ待機します。
+    """
+
+    def __init__(self, requests_per_minute):
+        self.capacity = float(requests_per_minute)
+        self.refill_per_second = requests_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.refill_per_second
+            time.sleep(wait_seconds)
+
+
+sheets_rate_limiter = RateLimiter(SHEETS_REQUESTS_PER_MINUTE)
+_thread_local = threading.local()
+
+
+def get_gclient():
+    """
+    スレッドごとに独立した gspread クライアントを返します（メインスレッドは共通の gclient）。
+    """
+    if threading.current_thread() is threading.main_thread():
+        return gclient
+    if not hasattr(_thread_local, "gclient"):
+        _thread_local.gclient = gspread.authorize(creds)
+    return _thread_local.gclient
 
 
 def get_data_from_firebase(path):
@@ -91,7 +153,90 @@ def get_period_from_now(now):
     return None
 
 
-def process_single_class(class_index, now, current_day, current_sheet_name, current_day_of_month):
+def get_list_or_dict_item(container, key):
+    """
+    Firebase が配列(list)または辞書(dict)で返すノードから、key に対応する要素を取り出します。
+    """
+    if isinstance(container, list):
+        try:
+            index = int(key)
+        except (TypeError, ValueError):
+            return None
+        return container[index] if 0 <= index < len(container) else None
+    if isinstance(container, dict):
+        return container.get(str(key))
+    return None
+
+
+class FirebaseSnapshot:
+    """
+    1回の実行で必要なFirebaseのデータをまとめて保持し、クラスごとの参照をメモリ上で解決します。
+    """
+
+    def __init__(self, classes, student_info, attendance, courses):
+        self.classes = classes or {}
+        self.student_info = student_info or {}
+        self.attendance = attendance or {}
+        self.courses = courses or []
+
+    @classmethod
+    def load(cls):
+        """
+        必要なサブツリーを1回ずつ取得してスナップショットを作成します。
+        """
+        return cls(
+            classes=get_data_from_firebase("Classes/class_index"),
+            student_info=get_data_from_firebase("Students/student_info/student_index"),
+            attendance=get_data_from_firebase("Students/attendance/student_id"),
+            courses=get_data_from_firebase("Courses/course_id"),
+        )
+
+    def get_class(self, class_index):
+        return self.classes.get(class_index)
+
+    def get_student_id(self, student_idx):
+        info = self.student_info.get(student_idx)
+        if not isinstance(info, dict):
+            return None
+        return info.get("student_id")
+
+    def get_attendance(self, student_id):
+        return self.attendance.get(student_id)
+
+    def get_course(self, course_id):
+        return get_list_or_dict_item(self.courses, course_id)
+
+    def get_decision(self, student_id, course_id):
+        attendance_data = self.get_attendance(student_id)
+        if not isinstance(attendance_data, dict):
+            return None
+        course_data = get_list_or_dict_item(attendance_data.get("course_id"), course_id)
+        if not isinstance(course_data, dict):
+            return None
+        return course_data.get("decision")
+
+
+def write_cells_to_sheet(sheet, cell_values):
+    """
+    {(row, col): 値} のセルを、1回の batch_update でまとめてワークシートに書き込みます。
+    """
+    if not cell_values:
+        print("[Debug] No cells to update.")
+        return
+
+    data = [
+        {"range": gspread.utils.rowcol_to_a1(row, col), "values": [[value]]}
+        for (row, col), value in sorted(cell_values.items())
+    ]
+    try:
+        sheets_rate_limiter.wait()
+        sheet.batch_update(data, value_input_option="USER_ENTERED")
+        print(f"[Debug] Updated {len(data)} cells in worksheet '{sheet.title}' with one batch_update.")
+    except Exception as e:
+        print(f"[Debug] Error updating sheet '{sheet.title}': {e}")
+
+
+def process_single_class(class_index, snapshot, now, current_day, current_sheet_name, current_day_of_month):
     """
     1つのクラスを処理する。  
     指定クラスのスプレッドシートを開き、
@@ -101,7 +246,7 @@ def process_single_class(class_index, now, current_day, current_sheet_name, curr
     print(f"\n[Debug] ========== Start processing class_index: {class_index} ==========")
     # Classデータ取得（パスを統一）
     class_data_path = f"Classes/class_index/{class_index}"
-    class_data = get_data_from_firebase(class_data_path)
+    class_data = snapshot.get_class(class_index)
     if not class_data:
         print(f"[Debug] No data found for class_index: {class_index}")
         return
@@ -129,9 +274,11 @@ def process_single_class(class_index, now, current_day, current_sheet_name, curr
 
     # シートを取得
     try:
-        sh = gclient.open_by_key(class_sheet_id)
+        sheets_rate_limiter.wait()
+        sh = get_gclient().open_by_key(class_sheet_id)
         print(f"[Debug] Opened Google Sheet: {sh.title}")
         try:
+            sheets_rate_limiter.wait()
             sheet = sh.worksheet(current_sheet_name)
         except gspread.exceptions.WorksheetNotFound:
             print(f"[Debug] Worksheet '{current_sheet_name}' not found in spreadsheet {class_sheet_id}.")
@@ -148,20 +295,21 @@ def process_single_class(class_index, now, current_day, current_sheet_name, curr
         print("[Debug] 現在の時刻はどの授業時間にも該当しません。")
         return
 
+    # 書き込むセルを (row, col) -> 値 で集め、最後に1回でまとめて書き込む
+    cell_values = {}
+
     # 学生ごとの attendance をチェック
     for idx, student_idx in enumerate(student_indices, start=1):
         row_number = idx + 2
         print(f"\n[Debug] Processing student_index: {student_idx} (row={row_number})")
 
-        student_id_path = f"Students/student_info/student_index/{student_idx}/student_id"
-        student_id = get_data_from_firebase(student_id_path)
+        student_id = snapshot.get_student_id(student_idx)
         if not student_id:
             print(f"[Debug] No student_id found for student_index {student_idx}. Skipping.")
             continue
         print(f"[Debug] Found student_id: {student_id}")
 
-        attendance_path = f"Students/attendance/student_id/{student_id}"
-        attendance_data = get_data_from_firebase(attendance_path)
+        attendance_data = snapshot.get_attendance(student_id)
         if not attendance_data:
             print(f"[Debug] No attendance data for student_id {student_id}. Skipping.")
             continue
@@ -177,15 +325,12 @@ def process_single_class(class_index, now, current_day, current_sheet_name, curr
             # entryのみの場合：現在の period のセルのみ更新する
             col_number = map_date_period_to_column(current_day_of_month, current_period)
             status = "〇"
-            try:
-                sheet.update_cell(row_number, col_number, status)
-                print(f"[Debug] (Entry only) Updated cell (row={row_number}, col={col_number}) with '{status}'.")
-            except Exception as e:
-                print(f"[Debug] Error updating sheet for student_index {student_idx}: {e}")
+            cell_values[(row_number, col_number)] = status
+            print(f"[Debug] (Entry only) Queued cell (row={row_number}, col={col_number}) with '{status}'.")
         else:
             # entry, exit 両方がある場合：各 course_id ごとに decision を取得し、対応する period のセルを更新
             for cid in possible_course_ids:
-                course_info = get_data_from_firebase(f"Courses/course_id/{cid}")
+                course_info = snapshot.get_course(cid)
                 if not course_info:
                     print(f"[Debug] No course info found for course_id {cid}. Skipping this course.")
                     continue
@@ -196,42 +341,54 @@ def process_single_class(class_index, now, current_day, current_sheet_name, curr
                     continue
 
                 col_number = map_date_period_to_column(current_day_of_month, course_period)
-                decision_path = f"Students/attendance/student_id/{student_id}/course_id/{cid}/decision"
-                decision = get_data_from_firebase(decision_path)
+                decision = snapshot.get_decision(student_id, cid)
                 if decision is None:
                     decision = ""
                 status = decision
 
-                try:
-                    sheet.update_cell(row_number, col_number, status)
-                    print(f"[Debug] For course_id {cid} (period {course_period}), updated cell (row={row_number}, col={col_number}) with '{status}'.")
-                except Exception as e:
-                    print(f"[Debug] Error updating sheet for course_id {cid}: {e}")
+                cell_values[(row_number, col_number)] = status
+                print(f"[Debug] For course_id {cid} (period {course_period}), queued cell (row={row_number}, col={col_number}) with '{status}'.")
+
+    write_cells_to_sheet(sheet, cell_values)
 
 
-def main():
+def main(max_workers=MAX_CLASS_WORKERS):
     """
     全クラスをループし、共通処理をまとめて実行する。
+    クラスごとにスプレッドシートが独立しているため、max_workers 件まで並列に処理する。
     """
+    initialize_clients()
     now, current_day, current_sheet_name, current_day_of_month = get_current_date_details()
     print(f"[Debug] Now (JST): {now}")
     print(f"[Debug] Current day: {current_day}")
     print(f"[Debug] Current sheet name: {current_sheet_name}")
     print(f"[Debug] Current day of month: {current_day_of_month}")
 
-    all_classes_data = get_data_from_firebase("Classes/class_index")
-    if not all_classes_data:
+    # 必要なデータを1回だけ取得し、以降はメモリ上で参照する
+    snapshot = FirebaseSnapshot.load()
+    if not snapshot.classes:
         print("[Debug] No class data found at 'Classes/class_index'.")
         return
 
-    for class_index in all_classes_data.keys():
-        process_single_class(
-            class_index,
-            now,
-            current_day,
-            current_sheet_name,
-            current_day_of_month
-        )
+    args = (snapshot, now, current_day, current_sheet_name, current_day_of_month)
+
+    if max_workers <= 1:
+        for class_index in snapshot.classes.keys():
+            process_single_class(class_index, *args)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(process_single_class, class_index, *args): class_index
+            for class_index in snapshot.classes.keys()
+        }
+        for future in as_completed(futures):
+            class_index = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                # 1クラスの失敗が他のクラスに影響しないよう、ここで記録して続行する
+                print(f"[Debug] Error processing class_index {class_index}: {e}")
 
 
 if __name__ == "__main__":
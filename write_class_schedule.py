@@ -1,3 +1,6 @@
+import socket
+import sys
+import time
 from firebase_admin import credentials, initialize_app, db
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
@@ -5,9 +8,10 @@ from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
 from google_auth_httplib2 import AuthorizedHttp
 import httplib2
-import time
-import socket
-from datetime import datetime, timedelta
+from month_calendar import academic_year_months, current_academic_year, get_month_calendar
+from sheet_metadata_cache import SheetMetadataCache
+from sheet_request_coalescer import coalesce_requests
+from sheet_template import allocate_template_sheet, build_template_provisioning_requests
 
 
 def initialize_firebase():
@@ -84,15 +88,17 @@ def create_cell_update_request(sheet_id, row_index, column_index, value):
     }
 
 
-def create_sheet_request(sheet_title):
+def create_sheet_request(sheet_title, sheet_id=None):
     """
     新しいワークシートを追加するためのリクエストを作成します。
+    sheet_id を指定した場合は、その sheetId でシートを追加します。
     """
+    properties = {"title": sheet_title}
+    if sheet_id is not None:
+        properties["sheetId"] = sheet_id
     return {
         "addSheet": {
-            "properties": {
-                "title": sheet_title,
-            }
+            "properties": properties
         }
     }
 
@@ -154,15 +160,13 @@ def create_black_background_request(sheet_id, start_row, end_row, start_col, end
     }
 
 
-def generate_unique_sheet_title(sheets_service, spreadsheet_id, base_title):
+def generate_unique_sheet_title(metadata_cache, spreadsheet_id, base_title):
     """
     スプレッドシート内で重複しないシート名を生成します。
+    既存のシート名は metadata_cache から取得します。
     """
     print(f"[Debug] Generating unique sheet title for base: {base_title}")
-    existing_sheets = execute_with_retry(
-        sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id)
-    ).get("sheets", [])
-    sheet_titles = [sheet["properties"]["title"] for sheet in existing_sheets]
+    sheet_titles = metadata_cache.titles(spreadsheet_id)
 
     title = base_title
     counter = 1
@@ -198,47 +202,20 @@ def get_student_data(class_index):
     return student_names, attendance_numbers
 
 
-def prepare_update_requests(sheet_id, student_names, attendance_numbers, month, sheets_service, spreadsheet_id, year=2025):
+def build_layout_requests(sheet_id, student_names, attendance_numbers):
     """
-    1つの月用シートを作成し、学生名・出席番号、日付・週末色付けなどを設定するリクエストを返します。
+    全月で共通の書式 (列幅・中央揃え・罫線・フィルター・黒背景) と学生名・出席番号を設定するリクエストを返します。
     """
-    if not student_names:
-        print("[Debug] 学生名リストが空です。Firebaseから取得したデータを確認してください。")
-        return []
-
-    base_title = f"{year}-{str(month).zfill(2)}"
-    sheet_title = generate_unique_sheet_title(sheets_service, spreadsheet_id, base_title)
-
-    # 新しいシートを追加
-    add_sheet_request = create_sheet_request(sheet_title)
-    requests = [add_sheet_request]
-
-    print(f"[Debug] Creating new sheet: {sheet_title}")
-    response = execute_with_retry(
-        sheets_service.spreadsheets().batchUpdate(
-            spreadsheetId=spreadsheet_id,
-            body={"requests": requests},
-        )
-    )
-
-    new_sheet_id = next(
-        (reply["addSheet"]["properties"]["sheetId"] for reply in response.get("replies", []) if "addSheet" in reply),
-        None,
-    )
-    if new_sheet_id is None:
-        print("[Debug] 新しいシートのIDを取得できませんでした。")
-        return []
-
     # 列や行幅の調整
     requests = [
-        {"appendDimension": {"sheetId": new_sheet_id, "dimension": "COLUMNS", "length": 126}},
-        create_dimension_request(new_sheet_id, "COLUMNS", 0, 1, 35),
-        create_dimension_request(new_sheet_id, "COLUMNS", 1, 1, 100),
-        create_dimension_request(new_sheet_id, "COLUMNS", 2, 126, 35),
-        create_dimension_request(new_sheet_id, "ROWS", 0, 1, 120),
+        {"appendDimension": {"sheetId": sheet_id, "dimension": "COLUMNS", "length": 126}},
+        create_dimension_request(sheet_id, "COLUMNS", 0, 1, 35),
+        create_dimension_request(sheet_id, "COLUMNS", 1, 1, 100),
+        create_dimension_request(sheet_id, "COLUMNS", 2, 126, 35),
+        create_dimension_request(sheet_id, "ROWS", 0, 1, 120),
         {
             "repeatCell": {
-                "range": {"sheetId": new_sheet_id},
+                "range": {"sheetId": sheet_id},
                 "cell": {"userEnteredFormat": {"horizontalAlignment": "CENTER"}},
                 "fields": "userEnteredFormat.horizontalAlignment",
             }
@@ -246,7 +223,7 @@ def prepare_update_requests(sheet_id, student_names, attendance_numbers, month,
         {
             "updateBorders": {
                 "range": {
-                    "sheetId": new_sheet_id,
+                    "sheetId": sheet_id,
                     "startRowIndex": 0,
                     "endRowIndex": 35,
                     "startColumnIndex": 0,
@@ -262,7 +239,7 @@ def prepare_update_requests(sheet_id, student_names, attendance_numbers, month,
             "setBasicFilter": {
                 "filter": {
                     "range": {
-                        "sheetId": new_sheet_id,
+                        "sheetId": sheet_id,
                         "startRowIndex": 0,
                         "endRowIndex": 35,
                         "startColumnIndex": 0,
@@ -275,61 +252,103 @@ def prepare_update_requests(sheet_id, student_names, attendance_numbers, month,
 
     # 学生名・出席番号のヘッダー部分
     print("[Debug] Writing student names and attendance numbers...")
-    requests.append(create_cell_update_request(new_sheet_id, 0, 1, "学生名"))
-    requests.append(create_cell_update_request(new_sheet_id, 0, 0, "AN"))
+    requests.append(create_cell_update_request(sheet_id, 0, 1, "学生名"))
+    requests.append(create_cell_update_request(sheet_id, 0, 0, "AN"))
 
     for i, (name, attendance_number) in enumerate(zip(student_names, attendance_numbers)):
-        requests.append(create_cell_update_request(new_sheet_id, i + 2, 1, name))
-        requests.append(create_cell_update_request(new_sheet_id, i + 2, 0, attendance_number))
+        requests.append(create_cell_update_request(sheet_id, i + 2, 1, name))
+        requests.append(create_cell_update_request(sheet_id, i + 2, 0, attendance_number))
+
+    # 黒背景設定
+    print("[Debug] Setting background color for unused cells...")
+    requests.append(create_black_background_request(sheet_id, 35, 1000, 0, 1000))
+    requests.append(create_black_background_request(sheet_id, 0, 1000, 126, 1000))
+
+    return requests
 
-    # 日付と授業時限列の設定
+
+def build_month_requests(sheet_id, calendar_layout):
+    """
+    月ごとに異なる日付・授業時限のヘッダーと土日の色付けのリクエストを返します。
+    """
+    requests = []
+    # 日付と授業時限列の設定 (1日目はC列、1日4列)
     print("[Debug] Setting dates and periods...")
-    japanese_weekdays = ["月", "火", "水", "木", "金", "土", "日"]
-    start_date = datetime(year, month, 1)
-    end_date = (start_date + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-    current_date = start_date
     start_column = 2
     period_labels = ["1,2限", "3,4限", "5,6限", "7,8限"]
 
-    while current_date <= end_date:
-        weekday = current_date.weekday()
-        date_string = (
-            f"{current_date.strftime('%m')}\n月\n"
-            f"{current_date.strftime('%d')}\n日\n⌢\n"
-            f"{japanese_weekdays[weekday]}\n⌣"
-        )
-        requests.append(create_cell_update_request(new_sheet_id, 0, start_column, date_string))
-
+    for column, date_string in calendar_layout.date_header_cells(start_column, len(period_labels)):
+        requests.append(create_cell_update_request(sheet_id, 0, column, date_string))
         for period_index, period in enumerate(period_labels):
-            requests.append(create_cell_update_request(new_sheet_id, 1, start_column + period_index, period))
+            requests.append(create_cell_update_request(sheet_id, 1, column + period_index, period))
 
-        if weekday == 5:
-            color = {"red": 0.8, "green": 0.9, "blue": 1.0}
-            requests.append(
-                create_weekend_color_request(
-                    new_sheet_id, 0, 35, start_column, start_column + len(period_labels), color
-                )
-            )
-        elif weekday == 6:
-            color = {"red": 1.0, "green": 0.8, "blue": 0.8}
-            requests.append(
-                create_weekend_color_request(
-                    new_sheet_id, 0, 35, start_column, start_column + len(period_labels), color
-                )
-            )
+    for start_col, end_col, color in calendar_layout.weekend_column_ranges(start_column, len(period_labels)):
+        requests.append(create_weekend_color_request(sheet_id, 0, 35, start_col, end_col, color))
 
-        start_column += len(period_labels)
-        current_date += timedelta(days=1)
+    return requests
 
-    # 黒背景設定
-    print("[Debug] Setting background color for unused cells...")
-    requests.append(create_black_background_request(new_sheet_id, 35, 1000, 0, 1000))
-    requests.append(create_black_background_request(new_sheet_id, 0, 1000, 126, 1000))
 
+def prepare_update_requests(sheet_id, student_names, attendance_numbers, calendar_layout, sheets_service, spreadsheet_id, metadata_cache):
+    """
+    1つの月用シートを作成し、学生名・出席番号、日付・週末色付けなどを設定するリクエストを返します。
+    """
+    if not student_names:
+        print("[Debug] 学生名リストが空です。Firebaseから取得したデータを確認してください。")
+        return []
+
+    sheet_title = generate_unique_sheet_title(metadata_cache, spreadsheet_id, calendar_layout.sheet_title)
+
+    # 新しいシートを追加
+    add_sheet_request = create_sheet_request(sheet_title)
+    requests = [add_sheet_request]
+
+    print(f"[Debug] Creating new sheet: {sheet_title}")
+    response = execute_with_retry(
+        sheets_service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={"requests": requests},
+        )
+    )
+
+    new_sheet_id = next(
+        (reply["addSheet"]["properties"]["sheetId"] for reply in response.get("replies", []) if "addSheet" in reply),
+        None,
+    )
+    if new_sheet_id is None:
+        print("[Debug] 新しいシートのIDを取得できませんでした。")
+        return []
+    metadata_cache.add_sheet(spreadsheet_id, sheet_title, new_sheet_id)
+
+    requests = build_layout_requests(new_sheet_id, student_names, attendance_numbers)
+    requests.extend(build_month_requests(new_sheet_id, calendar_layout))
     return requests
 
 
-def main():
+def prepare_template_requests(template_sheet_id, template_title, month_sheets, student_names, attendance_numbers, first_index):
+    """
+    テンプレートシートに共通の書式と学生名・出席番号を1回だけ設定し、duplicateSheet で各月のシートを
+    作成するリクエストを返します。month_sheets は [(sheetId, シート名, MonthCalendar), ...]。
+    """
+    if not student_names:
+        print("[Debug] 学生名リストが空です。Firebaseから取得したデータを確認してください。")
+        return []
+
+    return build_template_provisioning_requests(
+        create_sheet_request(template_title, template_sheet_id),
+        template_sheet_id,
+        build_layout_requests(template_sheet_id, student_names, attendance_numbers),
+        [
+            (new_sheet_id, sheet_title, build_month_requests(new_sheet_id, calendar_layout))
+            for new_sheet_id, sheet_title, calendar_layout in month_sheets
+        ],
+        first_index,
+    )
+
+
+def main(academic_year=None, use_template=False):
+    if academic_year is None:
+        academic_year = current_academic_year()
+    print(f"[Debug] Academic year: {academic_year}, template mode: {use_template}")
     print("[Debug] Initializing Firebase and Google Sheets...")
     initialize_firebase()
     sheets_service = get_google_sheets_service()
@@ -340,6 +359,9 @@ def main():
         print("[Debug] Classインデックスを取得できませんでした。")
         return
 
+    # シート名はスプレッドシートごとに1回だけ取得する
+    metadata_cache = SheetMetadataCache(sheets_service, execute_with_retry)
+
     for class_index, class_data in class_indices.items():
         spreadsheet_id = class_data.get("class_sheet_id")
         if not spreadsheet_id:
@@ -352,15 +374,43 @@ def main():
             print(f"[Debug] クラス {class_index} に一致する学生名が見つかりませんでした。")
             continue
 
-        for month in range(1, 13):
-            print(f"[Debug] Processing month: {month} for class index: {class_index}")
+        if use_template:
+            # テンプレートシートを1つ作り、12か月分を duplicateSheet で作成して1回の batchUpdate で送る
+            first_index = len(metadata_cache.sheet_ids(spreadsheet_id))
+            month_sheets = []
+            for year, month in academic_year_months(academic_year):
+                calendar_layout = get_month_calendar(year, month)
+                sheet_title = generate_unique_sheet_title(metadata_cache, spreadsheet_id, calendar_layout.sheet_title)
+                new_sheet_id = metadata_cache.allocate_sheet_id(spreadsheet_id, year * 100 + month)
+                metadata_cache.add_sheet(spreadsheet_id, sheet_title, new_sheet_id)
+                month_sheets.append((new_sheet_id, sheet_title, calendar_layout))
+            template_title, template_sheet_id = allocate_template_sheet(metadata_cache, spreadsheet_id, academic_year * 100)
+
+            requests = prepare_template_requests(
+                template_sheet_id, template_title, month_sheets, student_names, attendance_numbers, first_index
+            )
+            print(f"[Debug] Executing batchUpdate from template sheet, class_index={class_index}...")
+            execute_with_retry(
+                sheets_service.spreadsheets().batchUpdate(
+                    spreadsheetId=spreadsheet_id,
+                    body={"requests": coalesce_requests(requests)},
+                )
+            )
+            # テンプレートシートは同じ batchUpdate の最後で削除済み
+            metadata_cache.remove_sheet(spreadsheet_id, template_title, template_sheet_id)
+            print(f"[Debug] クラス {class_index} の12か月分のシートを正常に作成しました。")
+            continue
+
+        for year, month in academic_year_months(academic_year):
+            print(f"[Debug] Processing month: {year}-{month:02d} for class index: {class_index}")
             requests = prepare_update_requests(
                 class_index,
                 student_names,
                 attendance_numbers,
-                month,
+                get_month_calendar(year, month),
                 sheets_service,
-                spreadsheet_id
+                spreadsheet_id,
+                metadata_cache,
             )
             if not requests:
                 print(f"[Debug] 月 {month} のシートを更新するリクエストがありません。")
@@ -370,11 +420,14 @@ def main():
             execute_with_retry(
                 sheets_service.spreadsheets().batchUpdate(
                     spreadsheetId=spreadsheet_id,
-                    body={"requests": requests},
+                    body={"requests": coalesce_requests(requests)},
                 )
             )
             print(f"[Debug] 月 {month} のシートを正常に更新しました。")
 
 
 if __name__ == "__main__":
-    main()
+    # 引数で年度を指定できる (例: python write_class_schedule.py 2025)。省略時は今日の日付から決める
+    # --template を付けると、テンプレートシートを複製して各月のシートを作成する
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    main(int(args[0]) if args else None, use_template="--template" in sys.argv[1:])
@@ -8,27 +8,43 @@ from oauth2client.service_account import ServiceAccountCredentials
 # ---------------------
 # Firebase & GSpread初期化
 # ---------------------
-if not firebase_admin._apps:
-    cred = credentials.Certificate("/tmp/firebase_service_account.json")
-    firebase_admin.initialize_app(
-        cred,
-        {"databaseURL": "https://test-51ebc-default-rtdb.firebaseio.com/"},
-    )
-    print("[Debug] Firebase initialized.")
+# initialize_clients() で設定する（import しただけでは認証しない）
+gclient = None
+
+
+def initialize_clients():
+    """
+    Firebase と gspread を初期化します。初期化済みの場合は再初期化しません。
+    """
+    global gclient
+    if not firebase_admin._apps:
+        cred = credentials.Certificate("/tmp/firebase_service_account.json")
+        firebase_admin.initialize_app(
+            cred,
+            {"databaseURL": "https://test-51ebc-default-rtdb.firebaseio.com/"},
+        )
+        print("[Debug] Firebase initialized.")
+
+    if gclient is None:
+        scope = [
+            "https://spreadsheets.google.com/feeds",
+            "https://www.googleapis.com/auth/drive",
+        ]
+        creds = ServiceAccountCredentials.from_json_keyfile_name("/tmp/gcp_service_account.json", scope)
+        gclient = gspread.authorize(creds)
+        print("[Debug] Google Sheets API authorized.")
+
 
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/drive",
-]
-creds = ServiceAccountCredentials.from_json_keyfile_name("/tmp/gcp_service_account.json", scope)
-gclient = gspread.authorize(creds)
-print("[Debug] Google Sheets API authorized.")
+# この実行で行った Firebase 読み込み回数（実行の最後に表示）
+firebase_read_count = 0
 
 
 def get_data_from_firebase(path):
     """
     Firebase Realtime Database から指定パスのデータを取得します。
     """
+    global firebase_read_count
+    firebase_read_count += 1
     print(f"[Debug] Fetching data from Firebase path: {path}")
     ref = db.reference(path)
     data = ref.get()
@@ -62,7 +78,58 @@ def get_student_indices(student_indices_str):
     return [s.strip() for s in student_indices_str.split(",")]
 
 
+def get_list_or_dict_item(container, key):
+    """
+    Firebase が配列(list)または辞書(dict)で返すノードから、key に対応する要素を取り出します。
+    """
+    if isinstance(container, list):
+        try:
+            index = int(key)
+        except (TypeError, ValueError):
+            return None
+        return container[index] if 0 <= index < len(container) else None
+    if isinstance(container, dict):
+        return container.get(str(key))
+    return None
+
+
+def prefetch_course_data(course_ids):
+    """
+    対象コースの処理に必要なデータを一括で取得し、メモリ上の対応表を返します。
+      - enrollment_by_course: course_id -> "E523, E534" 形式の student_index 文字列
+      - student_id_by_index: student_index -> student_id
+      - decisions: (student_id, course_id) -> decision
+    """
+    enrollment_all = get_data_from_firebase("Students/enrollment/course_id")
+    enrollment_by_course = {}
+    for course_id in course_ids:
+        enrollment = get_list_or_dict_item(enrollment_all, course_id)
+        if isinstance(enrollment, dict):
+            enrollment_by_course[course_id] = enrollment.get("student_index")
+
+    student_index_data = get_data_from_firebase("Students/student_info/student_index") or {}
+    student_id_by_index = {
+        student_idx: info.get("student_id")
+        for student_idx, info in student_index_data.items()
+        if isinstance(info, dict)
+    }
+
+    attendance_all = get_data_from_firebase("Students/attendance/student_id") or {}
+    decisions = {}
+    for student_id, attendance in attendance_all.items():
+        if not isinstance(attendance, dict):
+            continue
+        course_nodes = attendance.get("course_id")
+        for course_id in course_ids:
+            course_data = get_list_or_dict_item(course_nodes, course_id)
+            if isinstance(course_data, dict) and course_data.get("decision") is not None:
+                decisions[(student_id, course_id)] = course_data["decision"]
+
+    return enrollment_by_course, student_id_by_index, decisions
+
+
 def main():
+    initialize_clients()
     current_day, current_sheet_name, current_day_of_month = get_current_date_details()
     print(f"[Debug] Current day: {current_day}")
     print(f"[Debug] Current sheet name: {current_sheet_name}")
@@ -92,11 +159,18 @@ def main():
         print("[Debug] No courses match the current day.")
         return
 
-    # 3. 一致するコースについて処理
+    # 3. 一致するコースについて、必要なデータを一括取得
+    enrollment_by_course, student_id_by_index, decisions = prefetch_course_data(
+        [course_id for course_id, _ in matched_courses]
+    )
+
+    # 4. 一致するコースについて処理
+    column = map_date_to_column(current_day_of_month)
+    print(f"[Debug] Mapped day of month '{current_day_of_month}' to column {column}.")
+
     for course_id, course_info in matched_courses:
         print(f"[Debug]\nProcessing Course ID: {course_id}, Course Name: {course_info.get('course_name')}")
-        enrollment_path = f"Students/enrollment/course_id/{course_id}/student_index"
-        student_indices_str = get_data_from_firebase(enrollment_path)
+        student_indices_str = enrollment_by_course.get(course_id)
         if not student_indices_str:
             print(f"[Debug] No students enrolled in course {course_id}.")
             continue
@@ -104,53 +178,65 @@ def main():
         student_indices = get_student_indices(student_indices_str)
         print(f"[Debug] Student indices for course {course_id}: {student_indices}")
 
-        # 4. 各学生について処理
+        sheet_id = course_info.get("course_sheet_id")
+        if not sheet_id:
+            print(f"[Debug] No course_sheet_id found for course {course_id}.")
+            continue
+        print(f"[Debug] Course Sheet ID: {sheet_id}")
+
+        # コースのスプレッドシートは1回だけ開く
+        try:
+            sh = gclient.open_by_key(sheet_id)
+            print(f"[Debug] Opened Google Sheet: {sh.title}")
+            sheet = sh.worksheet(current_sheet_name)
+            print(f"[Debug] Using worksheet: {sheet.title}")
+        except gspread.exceptions.SpreadsheetNotFound:
+            print(f"[Debug] Spreadsheet with ID {sheet_id} not found.")
+            continue
+        except gspread.exceptions.WorksheetNotFound:
+            print(f"[Debug] Worksheet named '{current_sheet_name}' not found in spreadsheet {sheet_id}.")
+            continue
+        except Exception as e:
+            print(f"[Debug] Error opening Google Sheet for course {course_id}: {e}")
+            continue
+
+        # 5. 各学生について処理し、当日の列をまとめて作成
+        #    decision が無い学生は None にして、既存のセルを上書きしない
+        column_values = []
         for idx, student_idx in enumerate(student_indices, start=1):
             row_number = idx + 1
             print(f"[Debug]\nProcessing Student {student_idx} (List Index: {idx}, Sheet Row: {row_number})")
+            column_values.append([None])
 
-            student_info_path = f"Students/student_info/student_index/{student_idx}/student_id"
-            student_id = get_data_from_firebase(student_info_path)
+            student_id = student_id_by_index.get(student_idx)
             if not student_id:
                 print(f"[Debug] No student_id found for student_index {student_idx}.")
                 continue
             print(f"[Debug] Student ID: {student_id}")
 
-            decision_path = f"Students/attendance/student_id/{student_id}/course_id/{course_id}/decision"
-            decision = get_data_from_firebase(decision_path)
+            decision = decisions.get((student_id, course_id))
             if decision is None:
                 print(f"[Debug] No decision found for student_id {student_id} in course {course_id}.")
                 continue
             print(f"[Debug] Decision: {decision}")
+            column_values[-1] = [decision]
 
-            sheet_id = course_info.get("course_sheet_id")
-            if not sheet_id:
-                print(f"[Debug] No course_sheet_id found for course {course_id}.")
-                continue
-            print(f"[Debug] Course Sheet ID: {sheet_id}")
-
-            try:
-                sh = gclient.open_by_key(sheet_id)
-                print(f"[Debug] Opened Google Sheet: {sh.title}")
-
-                try:
-                    sheet = sh.worksheet(current_sheet_name)
-                    print(f"[Debug] Using worksheet: {sheet.title}")
-                except gspread.exceptions.WorksheetNotFound:
-                    print(f"[Debug] Worksheet named '{current_sheet_name}' not found in spreadsheet {sheet_id}.")
-                    continue
-
-                column = map_date_to_column(current_day_of_month)
-                print(f"[Debug] Mapped day of month '{current_day_of_month}' to column {column}.")
-                sheet.update_cell(row_number, column, decision)
-                print(f"[Debug] Updated cell at row {row_number}, column {column} with decision '{decision}'.")
-
-            except gspread.exceptions.SpreadsheetNotFound:
-                print(f"[Debug] Spreadsheet with ID {sheet_id} not found.")
-            except gspread.exceptions.WorksheetNotFound:
-                print(f"[Debug] Worksheet '{current_sheet_name}' not found in spreadsheet {sheet_id}.")
-            except Exception as e:
-                print(f"[Debug] Error updating Google Sheet for course {course_id}, student {student_idx}: {e}")
+        if all(value is None for (value,) in column_values):
+            print(f"[Debug] No decisions to write for course {course_id}.")
+            continue
+
+        # 2行目から学生数分の範囲を1回で書き込む
+        range_name = (
+            f"{gspread.utils.rowcol_to_a1(2, column)}:"
+            f"{gspread.utils.rowcol_to_a1(len(column_values) + 1, column)}"
+        )
+        try:
+            sheet.update(range_name=range_name, values=column_values, value_input_option="USER_ENTERED")
+            print(f"[Debug] Updated range {range_name} for course {course_id}.")
+        except Exception as e:
+            print(f"[Debug] Error updating Google Sheet for course {course_id}: {e}")
+
+    print(f"[Debug] Firebase reads in this run: {firebase_read_count}")
 
 
 if __name__ == "__main__":
@@ -1,12 +1,16 @@
+import socket
+import sys
+import time
 from firebase_admin import credentials, initialize_app, db
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google_auth_httplib2 import AuthorizedHttp
 import httplib2
-import time
-import socket
-from datetime import datetime, timedelta
+from month_calendar import academic_year_months, current_academic_year, get_month_calendar
+from sheet_metadata_cache import SheetMetadataCache
+from sheet_request_coalescer import coalesce_requests
+from sheet_template import allocate_template_sheet, build_template_provisioning_requests
 
 
 def initialize_firebase():
@@ -212,60 +216,60 @@ def create_black_background_request(sheet_id, start_row, end_row, start_col, end
     }
 
 
-def prepare_update_requests(sheet_id, student_names, attendance_numbers, month, sheets_service, spreadsheet_id, year=2025):
+def generate_unique_sheet_title(metadata_cache, spreadsheet_id, base_title):
     """
-    1つの月シートを作成し、学生名・出席番号を入力し、日付列を作成するためのリクエストを組み立てます。
+    スプレッドシート内で重複しないシート名を生成します。
+    既存のシート名は metadata_cache から取得します。
     """
-    if not student_names:
-        print("[Debug] 学生名リストが空です。")
-        return []
+    print(f"[Debug] Generating unique sheet title for base: {base_title}")
+    sheet_titles = metadata_cache.titles(spreadsheet_id)
 
-    # シート作成リクエストをまず追加
-    base_title = f"{year}-{str(month).zfill(2)}"
-    add_sheet_request = {
+    title = base_title
+    counter = 1
+    while title in sheet_titles:
+        title = f"{base_title} ({counter})"
+        counter += 1
+    print(f"[Debug] Final sheet title: {title}")
+    return title
+
+
+def create_sheet_request(sheet_title, sheet_id=None):
+    """
+    新しいワークシートを追加するためのリクエストを作成します。
+    sheet_id を指定した場合は、その sheetId でシートを追加します。
+    """
+    properties = {"title": sheet_title}
+    if sheet_id is not None:
+        properties["sheetId"] = sheet_id
+    return {
         "addSheet": {
-            "properties": {
-                "title": base_title
-            }
+            "properties": properties
         }
     }
 
-    # シートを追加してIDを取得
-    requests = [add_sheet_request]
-    print(f"[Debug] Adding new sheet titled '{base_title}'.")
-    response = execute_with_retry(
-        sheets_service.spreadsheets().batchUpdate(
-            spreadsheetId=spreadsheet_id,
-            body={"requests": requests},
-        )
-    )
-
-    new_sheet_id = next(
-        (reply["addSheet"]["properties"]["sheetId"] for reply in response.get("replies", []) if "addSheet" in reply),
-        None,
-    )
-    if new_sheet_id is None:
-        print("[Debug] 新しいシートのIDを取得できませんでした。")
-        return []
 
+def build_layout_requests(sheet_id, student_names, attendance_numbers):
+    """
+    全月で共通の書式 (列幅・中央揃え・罫線・フィルター・黒背景) と学生名・出席番号を設定するリクエストを返します。
+    """
     # 列・行幅などを設定
     requests = [
         {
             "appendDimension": {
-                "sheetId": new_sheet_id,
+                "sheetId": sheet_id,
                 "dimension": "COLUMNS",
                 "length": 35,
             }
         },
-        create_dimension_request(new_sheet_id, "COLUMNS", 0, 1, 30),
-        create_dimension_request(new_sheet_id, "COLUMNS", 1, 2, 100),
-        create_dimension_request(new_sheet_id, "COLUMNS", 2, 35, 35),
-        create_dimension_request(new_sheet_id, "ROWS", 0, 1, 120),
-        create_dimension_request(new_sheet_id, "ROWS", 1, 35, 30),
+        create_dimension_request(sheet_id, "COLUMNS", 0, 1, 30),
+        create_dimension_request(sheet_id, "COLUMNS", 1, 2, 100),
+        create_dimension_request(sheet_id, "COLUMNS", 2, 35, 35),
+        create_dimension_request(sheet_id, "ROWS", 0, 1, 120),
+        create_dimension_request(sheet_id, "ROWS", 1, 35, 30),
         {
             "repeatCell": {
                 "range": {
-                    "sheetId": new_sheet_id,
+                    "sheetId": sheet_id,
                     "startRowIndex": 0,
                     "endRowIndex": 35,
                     "startColumnIndex": 0,
@@ -278,7 +282,7 @@ def prepare_update_requests(sheet_id, student_names, attendance_numbers, month,
         {
             "updateBorders": {
                 "range": {
-                    "sheetId": new_sheet_id,
+                    "sheetId": sheet_id,
                     "startRowIndex": 0,
                     "endRowIndex": 35,
                     "startColumnIndex": 0,
@@ -294,7 +298,7 @@ def prepare_update_requests(sheet_id, student_names, attendance_numbers, month,
             "setBasicFilter": {
                 "filter": {
                     "range": {
-                        "sheetId": new_sheet_id,
+                        "sheetId": sheet_id,
                         "startRowIndex": 0,
                         "endRowIndex": 35,
                         "startColumnIndex": 0,
@@ -307,50 +311,97 @@ def prepare_update_requests(sheet_id, student_names, attendance_numbers, month,
 
     # 学生名・出席番号をセット
     print("[Debug] Writing student names and attendance numbers...")
-    requests.append(create_cell_update_request(new_sheet_id, 0, 1, "学生名"))
-    requests.append(create_cell_update_request(new_sheet_id, 0, 0, "AN"))
+    requests.append(create_cell_update_request(sheet_id, 0, 1, "学生名"))
+    requests.append(create_cell_update_request(sheet_id, 0, 0, "AN"))
 
     for i, (name, attendance_number) in enumerate(zip(student_names, attendance_numbers)):
-        requests.append(create_cell_update_request(new_sheet_id, i + 1, 0, attendance_number))
-        requests.append(create_cell_update_request(new_sheet_id, i + 1, 1, name))
+        requests.append(create_cell_update_request(sheet_id, i + 1, 0, attendance_number))
+        requests.append(create_cell_update_request(sheet_id, i + 1, 1, name))
+
+    # 不要領域を黒背景に
+    print("[Debug] Setting background color for unused cells...")
+    requests.append(create_black_background_request(sheet_id, 35, 1000, 0, 1000))
+    requests.append(create_black_background_request(sheet_id, 0, 1000, 35, 1000))
+
+    return requests
 
-    # 日付を設定
+
+def build_month_requests(sheet_id, calendar_layout):
+    """
+    月ごとに異なる日付ヘッダーと土日の色付けのリクエストを返します。
+    """
+    requests = []
+    # 日付と土日の色付け (1日目はC列、1日1列)
     print("[Debug] Setting dates...")
-    japanese_weekdays = ["月", "火", "水", "木", "金", "土", "日"]
-    from datetime import datetime, timedelta
-    start_date = datetime(year, month, 1)
-    end_date = (start_date + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-    current_date = start_date
     start_column = 2
+    for column, date_string in calendar_layout.date_header_cells(start_column):
+        requests.append(create_cell_update_request(sheet_id, 0, column, date_string))
+    for start_col, end_col, color in calendar_layout.weekend_column_ranges(start_column):
+        requests.append(create_weekend_color_request(sheet_id, 0, 35, start_col, end_col, color))
 
-    while current_date <= end_date:
-        weekday = current_date.weekday()
-        date_string = (
-            f"{current_date.strftime('%m')}\n月\n"
-            f"{current_date.strftime('%d')}\n日\n⌢\n"
-            f"{japanese_weekdays[weekday]}\n⌣"
-        )
-        requests.append(create_cell_update_request(new_sheet_id, 0, start_column, date_string))
+    return requests
 
-        if weekday == 5:
-            color = {"red": 0.8, "green": 0.9, "blue": 1.0}
-            requests.append(create_weekend_color_request(new_sheet_id, 0, 35, start_column, start_column + 1, color))
-        elif weekday == 6:
-            color = {"red": 1.0, "green": 0.8, "blue": 0.8}
-            requests.append(create_weekend_color_request(new_sheet_id, 0, 35, start_column, start_column + 1, color))
 
-        start_column += 1
-        current_date += timedelta(days=1)
+def prepare_update_requests(sheet_id, student_names, attendance_numbers, calendar_layout, sheets_service, spreadsheet_id):
+    """
+    1つの月シートを作成し、学生名・出席番号を入力し、日付列を作成するためのリクエストを組み立てます。
+    """
+    if not student_names:
+        print("[Debug] 学生名リストが空です。")
+        return []
 
-    # 不要領域を黒背景に
-    print("[Debug] Setting background color for unused cells...")
-    requests.append(create_black_background_request(new_sheet_id, 35, 1000, 0, 1000))
-    requests.append(create_black_background_request(new_sheet_id, 0, 1000, 35, 1000))
+    # シート作成リクエストをまず追加
+    base_title = calendar_layout.sheet_title
+    add_sheet_request = create_sheet_request(base_title)
 
+    # シートを追加してIDを取得
+    requests = [add_sheet_request]
+    print(f"[Debug] Adding new sheet titled '{base_title}'.")
+    response = execute_with_retry(
+        sheets_service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={"requests": requests},
+        )
+    )
+
+    new_sheet_id = next(
+        (reply["addSheet"]["properties"]["sheetId"] for reply in response.get("replies", []) if "addSheet" in reply),
+        None,
+    )
+    if new_sheet_id is None:
+        print("[Debug] 新しいシートのIDを取得できませんでした。")
+        return []
+
+    requests = build_layout_requests(new_sheet_id, student_names, attendance_numbers)
+    requests.extend(build_month_requests(new_sheet_id, calendar_layout))
     return requests
 
 
-def main():
+def prepare_template_requests(template_sheet_id, template_title, month_sheets, student_names, attendance_numbers, first_index):
+    """
+    テンプレートシートに共通の書式と学生名・出席番号を1回だけ設定し、duplicateSheet で各月のシートを
+    作成するリクエストを返します。month_sheets は [(sheetId, シート名, MonthCalendar), ...]。
+    """
+    if not student_names:
+        print("[Debug] 学生名リストが空です。")
+        return []
+
+    return build_template_provisioning_requests(
+        create_sheet_request(template_title, template_sheet_id),
+        template_sheet_id,
+        build_layout_requests(template_sheet_id, student_names, attendance_numbers),
+        [
+            (new_sheet_id, sheet_title, build_month_requests(new_sheet_id, calendar_layout))
+            for new_sheet_id, sheet_title, calendar_layout in month_sheets
+        ],
+        first_index,
+    )
+
+
+def main(academic_year=None, use_template=False):
+    if academic_year is None:
+        academic_year = current_academic_year()
+    print(f"[Debug] Academic year: {academic_year}, template mode: {use_template}")
     print("[Debug] Initializing Firebase and Google Sheets...")
     initialize_firebase()
     sheets_service = get_google_sheets_service()
@@ -361,6 +412,9 @@ def main():
         print("[Debug] Courses データが見つかりません。")
         return
 
+    # テンプレートモードでは、シート名と sheetId をスプレッドシートごとに1回だけ取得する
+    metadata_cache = SheetMetadataCache(sheets_service, execute_with_retry)
+
     # ここを 1 から -> 0 からに変更
     for course_id in range(0, len(courses)):
         print(f"[Debug] Processing course_id={course_id}")
@@ -373,13 +427,52 @@ def main():
             print(f"[Debug] No student names found for course_id={course_id}. Skipping.")
             continue
 
-        for month in range(1, 13):
-            print(f"[Debug] Preparing requests for month={month}, course_id={course_id}")
+        if use_template:
+            # テンプレートシートを1つ作り、12か月分を duplicateSheet で作成して1回の batchUpdate で送る
+            try:
+                first_index = len(metadata_cache.sheet_ids(spreadsheet_id))
+            except HttpError as e:
+                print(f"[Debug] Failed to fetch sheet titles for course_id={course_id}: {e}")
+                continue
+            month_sheets = []
+            for year, month in academic_year_months(academic_year):
+                calendar_layout = get_month_calendar(year, month)
+                sheet_title = generate_unique_sheet_title(metadata_cache, spreadsheet_id, calendar_layout.sheet_title)
+                new_sheet_id = metadata_cache.allocate_sheet_id(spreadsheet_id, year * 100 + month)
+                metadata_cache.add_sheet(spreadsheet_id, sheet_title, new_sheet_id)
+                month_sheets.append((new_sheet_id, sheet_title, calendar_layout))
+            template_title, template_sheet_id = allocate_template_sheet(metadata_cache, spreadsheet_id, academic_year * 100)
+
+            requests = prepare_template_requests(
+                template_sheet_id, template_title, month_sheets, student_names, attendance_numbers, first_index
+            )
+            print(f"[Debug] Executing batchUpdate from template sheet, course_id={course_id} ...")
+            try:
+                execute_with_retry(
+                    sheets_service.spreadsheets().batchUpdate(
+                        spreadsheetId=spreadsheet_id,
+                        body={"requests": coalesce_requests(requests)},
+                    )
+                )
+            except HttpError as e:
+                # batchUpdate は全体が失敗するため、予定していたシートをキャッシュから取り除いて次のコースへ進む
+                print(f"[Debug] Failed to create sheets for course_id={course_id}: {e}")
+                for new_sheet_id, sheet_title, _ in month_sheets:
+                    metadata_cache.remove_sheet(spreadsheet_id, sheet_title, new_sheet_id)
+                metadata_cache.remove_sheet(spreadsheet_id, template_title, template_sheet_id)
+                continue
+            # テンプレートシートは同じ batchUpdate の最後で削除済み
+            metadata_cache.remove_sheet(spreadsheet_id, template_title, template_sheet_id)
+            print(f"[Debug] Sheets for 12 months created successfully (course_id={course_id}).")
+            continue
+
+        for year, month in academic_year_months(academic_year):
+            print(f"[Debug] Preparing requests for month={year}-{month:02d}, course_id={course_id}")
             requests = prepare_update_requests(
                 sheet_id=spreadsheet_id,
                 student_names=student_names,
                 attendance_numbers=attendance_numbers,
-                month=month,
+                calendar_layout=get_month_calendar(year, month),
                 sheets_service=sheets_service,
                 spreadsheet_id=spreadsheet_id
             )
@@ -388,7 +481,7 @@ def main():
                 execute_with_retry(
                     sheets_service.spreadsheets().batchUpdate(
                         spreadsheetId=spreadsheet_id,
-                        body={"requests": requests},
+                        body={"requests": coalesce_requests(requests)},
                     )
                 )
                 print(f"[Debug] Sheet for month={month} updated successfully.")
@@ -397,4 +490,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # 引数で年度を指定できる (例: python write_course_schedule.py 2025)。省略時は今日の日付から決める
+    # --template を付けると、テンプレートシートを複製して各月のシートを作成する
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    main(int(args[0]) if args else None, use_template="--template" in sys.argv[1:])
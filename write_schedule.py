@@ -1,8 +1,16 @@
 from firebase_admin import credentials, initialize_app, db
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
-from datetime import datetime, timedelta
+from googleapiclient.errors import HttpError
+import sys
+import time
+from month_calendar import academic_year_months, current_academic_year, get_month_calendar
+from sheet_metadata_cache import SheetMetadataCache
+from sheet_request_coalescer import coalesce_requests
+from sheet_template import allocate_template_sheet, build_template_provisioning_requests
 
+# この実行で行った Firebase 読み込み回数（実行の最後に表示）
+firebase_read_count = 0
 
 def initialize_firebase():
     """
@@ -32,6 +40,8 @@ def get_firebase_data(ref_path):
     """
     Firebaseから指定パスのデータを取得して返します。
     """
+    global firebase_read_count
+    firebase_read_count += 1
     print(f"[Debug] Fetching data from Firebase path: {ref_path}")
     ref = db.reference(ref_path)
     data = ref.get()
@@ -39,6 +49,20 @@ def get_firebase_data(ref_path):
         print(f"[Debug] No data found at path: {ref_path}")
     return data
 
+def load_courses_dict():
+    """
+    Courses/course_id を1回だけ取得し、{コースID(文字列): コース情報} の辞書にして返します。
+    データが不正な場合は None を返します。
+    """
+    courses = get_firebase_data("Courses/course_id")
+    if not isinstance(courses, list):
+        return None
+    return {
+        str(index): course
+        for index, course in enumerate(courses)
+        if course is not None and isinstance(course, dict)
+    }
+
 def execute_with_retry(request):
     # リトライ機能を実装し、スリープを追加
     retries = 3
@@ -83,6 +107,25 @@ def create_dimension_request(sheet_id, dimension, start_index, end_index, pixel_
     }
 
 
+def create_weekend_color_request(sheet_id, start_row, end_row, start_col, end_col, color):
+    """
+    土曜・日曜の列に背景色を付けるリクエストを作成します。
+    """
+    return {
+        "repeatCell": {
+            "range": {
+                "sheetId": sheet_id,
+                "startRowIndex": start_row,
+                "endRowIndex": end_row,
+                "startColumnIndex": start_col,
+                "endColumnIndex": end_col,
+            },
+            "cell": {"userEnteredFormat": {"backgroundColor": color}},
+            "fields": "userEnteredFormat.backgroundColor",
+        }
+    }
+
+
 def create_black_background_request(sheet_id, start_row, end_row, start_col, end_col):
     """
     指定範囲を黒背景に設定するリクエストを作成します。
@@ -103,13 +146,15 @@ def create_black_background_request(sheet_id, start_row, end_row, start_col, end
     }
 
 
-def create_sheet_request(sheet_title):
+def create_sheet_request(sheet_title, sheet_id):
     """
     新しいシートを作成するリクエストを作成します。
+    sheetId をクライアント側で指定するため、同じ batchUpdate の中で続けて書式設定できます。
     """
     return {
         "addSheet": {
             "properties": {
+                "sheetId": sheet_id,
                 "title": sheet_title,
                 "gridProperties": {
                     "rowCount": 1000,
@@ -120,66 +165,33 @@ def create_sheet_request(sheet_title):
     }
 
 
-def get_all_sheets(sheets_service, spreadsheet_id):
-    """
-    指定スプレッドシートのすべてのワークシート名をリストで返します。
-    """
-    spreadsheet = sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-    sheets = spreadsheet.get("sheets", [])
-    return [sheet["properties"]["title"] for sheet in sheets]
-
-
-def generate_unique_sheet_title(sheets_service, spreadsheet_id, base_title):
+def generate_unique_sheet_title(metadata_cache, spreadsheet_id, base_title):
     """
     シート名の重複を避けるため、base_title が存在する場合は連番を付けて返します。
+    既存のシート名は metadata_cache から取得し、決めたシート名はキャッシュに追加します。
     """
-    existing_titles = get_all_sheets(sheets_service, spreadsheet_id)
-    if base_title not in existing_titles:
-        return base_title
+    existing_titles = metadata_cache.titles(spreadsheet_id)
+    title = base_title
     index = 1
-    while f"{base_title}-{index}" in existing_titles:
+    while title in existing_titles:
+        title = f"{base_title}-{index}"
         index += 1
-    return f"{base_title}-{index}"
+    metadata_cache.add_sheet(spreadsheet_id, title)
+    return title
 
 
-def prepare_update_requests(sheet_id, course_names, month, sheets_service, spreadsheet_id, year=2025):
+def build_layout_requests(sheet_id, course_names):
     """
-    指定したコース名リストと年月から、スプレッドシート更新リクエストを作成して返します。
+    全月で共通の書式 (列幅・中央揃え・罫線・フィルター・黒背景) と教科名を設定するリクエストを返します。
     """
-    if not course_names:
-        print("[Debug] コース名リストが空です。Firebaseから取得したデータを確認してください。")
-        return []
-
-    # ユニークなシート名を生成
-    base_title = f"{year}-{str(month).zfill(2)}"
-    sheet_title = generate_unique_sheet_title(sheets_service, spreadsheet_id, base_title)
-
-    # 新しいシートを追加するリクエスト
-    add_sheet_request = create_sheet_request(sheet_title)
-    requests = [add_sheet_request]
-
-    # 先にbatchUpdateを実行してシートIDを取得
-    response = sheets_service.spreadsheets().batchUpdate(
-        spreadsheetId=spreadsheet_id, body={"requests": requests}
-    ).execute()
-
-    new_sheet_id = None
-    for reply in response.get("replies", []):
-        if "addSheet" in reply:
-            new_sheet_id = reply["addSheet"]["properties"]["sheetId"]
-    if new_sheet_id is None:
-        print("[Debug] 新しいシートのIDを取得できませんでした。")
-        return []
-
-    # 追加後のリクエストを再構築
     requests = [
-        {"appendDimension": {"sheetId": new_sheet_id, "dimension": "COLUMNS", "length": 32}},
-        create_dimension_request(new_sheet_id, "COLUMNS", 0, 1, 100),
-        create_dimension_request(new_sheet_id, "COLUMNS", 1, 32, 35),
-        create_dimension_request(new_sheet_id, "ROWS", 0, 1, 120),
+        {"appendDimension": {"sheetId": sheet_id, "dimension": "COLUMNS", "length": 32}},
+        create_dimension_request(sheet_id, "COLUMNS", 0, 1, 100),
+        create_dimension_request(sheet_id, "COLUMNS", 1, 32, 35),
+        create_dimension_request(sheet_id, "ROWS", 0, 1, 120),
         {
             "repeatCell": {
-                "range": {"sheetId": new_sheet_id},
+                "range": {"sheetId": sheet_id},
                 "cell": {"userEnteredFormat": {"horizontalAlignment": "CENTER"}},
                 "fields": "userEnteredFormat.horizontalAlignment",
             }
@@ -187,7 +199,7 @@ def prepare_update_requests(sheet_id, course_names, month, sheets_service, sprea
         {
             "updateBorders": {
                 "range": {
-                    "sheetId": new_sheet_id,
+                    "sheetId": sheet_id,
                     "startRowIndex": 0,
                     "endRowIndex": 25,
                     "startColumnIndex": 0,
@@ -203,7 +215,7 @@ def prepare_update_requests(sheet_id, course_names, month, sheets_service, sprea
             "setBasicFilter": {
                 "filter": {
                     "range": {
-                        "sheetId": new_sheet_id,
+                        "sheetId": sheet_id,
                         "startRowIndex": 0,
                         "endRowIndex": 25,
                         "startColumnIndex": 0,
@@ -215,71 +227,72 @@ def prepare_update_requests(sheet_id, course_names, month, sheets_service, sprea
     ]
 
     # 教科名を設定
-    requests.append(create_cell_update_request(new_sheet_id, 0, 0, "教科"))
+    requests.append(create_cell_update_request(sheet_id, 0, 0, "教科"))
     for i, name in enumerate(course_names):
-        requests.append(create_cell_update_request(new_sheet_id, i + 1, 0, name))
+        requests.append(create_cell_update_request(sheet_id, i + 1, 0, name))
+
+    # 使わない領域を黒背景に
+    requests.append(create_black_background_request(sheet_id, 25, 1000, 0, 1000))
+    requests.append(create_black_background_request(sheet_id, 0, 1000, 32, 1000))
+
+    return requests
+
 
-    # 日付と土日セルの色付け
-    japanese_weekdays = ["月", "火", "水", "木", "金", "土", "日"]
-    start_date = datetime(year, month, 1)
-    end_date = (start_date + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+def build_month_requests(sheet_id, calendar_layout):
+    """
+    月ごとに異なる日付ヘッダーと土日の色付けのリクエストを返します。
+    """
+    requests = []
+    # 日付と土日セルの色付け (1日目はB列、1日1列)
     end_row = 25
-    current_date = start_date
-
-    while current_date <= end_date:
-        weekday = current_date.weekday()  # 月=0, 日=6
-        date_string = (
-            f"{current_date.strftime('%m')}\n月\n"
-            f"{current_date.strftime('%d')}\n日\n⌢\n"
-            f"{japanese_weekdays[weekday]}\n⌣"
-        )
-        requests.append(create_cell_update_request(new_sheet_id, 0, current_date.day, date_string))
-
-        # 土曜日(5)・日曜日(6)の背景色を付ける
-        if weekday == 5:
-            color = {"red": 0.8, "green": 0.9, "blue": 1.0}
-            requests.append(
-                {
-                    "repeatCell": {
-                        "range": {
-                            "sheetId": new_sheet_id,
-                            "startRowIndex": 0,
-                            "endRowIndex": end_row,
-                            "startColumnIndex": current_date.day,
-                            "endColumnIndex": current_date.day + 1,
-                        },
-                        "cell": {"userEnteredFormat": {"backgroundColor": color}},
-                        "fields": "userEnteredFormat.backgroundColor",
-                    }
-                }
-            )
-        elif weekday == 6:
-            color = {"red": 1.0, "green": 0.8, "blue": 0.8}
-            requests.append(
-                {
-                    "repeatCell": {
-                        "range": {
-                            "sheetId": new_sheet_id,
-                            "startRowIndex": 0,
-                            "endRowIndex": end_row,
-                            "startColumnIndex": current_date.day,
-                            "endColumnIndex": current_date.day + 1,
-                        },
-                        "cell": {"userEnteredFormat": {"backgroundColor": color}},
-                        "fields": "userEnteredFormat.backgroundColor",
-                    }
-                }
-            )
-        current_date += timedelta(days=1)
+    for column, date_string in calendar_layout.date_header_cells(1):
+        requests.append(create_cell_update_request(sheet_id, 0, column, date_string))
+    for start_col, end_col, color in calendar_layout.weekend_column_ranges(1):
+        requests.append(create_weekend_color_request(sheet_id, 0, end_row, start_col, end_col, color))
+    return requests
 
-    # 使わない領域を黒背景に
-    requests.append(create_black_background_request(new_sheet_id, 25, 1000, 0, 1000))
-    requests.append(create_black_background_request(new_sheet_id, 0, 1000, 32, 1000))
 
+def prepare_update_requests(new_sheet_id, sheet_title, course_names, calendar_layout):
+    """
+    指定したコース名リストと月のカレンダー (MonthCalendar) から、
+    シート追加 (sheetId=new_sheet_id, シート名=sheet_title) と書式設定のリクエストを作成して返します。
+    """
+    if not course_names:
+        print("[Debug] コース名リストが空です。Firebaseから取得したデータを確認してください。")
+        return []
+
+    # 新しいシートを追加するリクエストと、その書式設定
+    requests = [create_sheet_request(sheet_title, new_sheet_id)]
+    requests.extend(build_layout_requests(new_sheet_id, course_names))
+    requests.extend(build_month_requests(new_sheet_id, calendar_layout))
     return requests
 
 
-def main():
+def prepare_template_requests(template_sheet_id, template_title, month_sheets, course_names, first_index):
+    """
+    テンプレートシートに共通の書式と教科名を1回だけ設定し、duplicateSheet で各月のシートを作成する
+    リクエストを返します。month_sheets は [(sheetId, シート名, MonthCalendar), ...]。
+    """
+    if not course_names:
+        print("[Debug] コース名リストが空です。Firebaseから取得したデータを確認してください。")
+        return []
+
+    return build_template_provisioning_requests(
+        create_sheet_request(template_title, template_sheet_id),
+        template_sheet_id,
+        build_layout_requests(template_sheet_id, course_names),
+        [
+            (new_sheet_id, sheet_title, build_month_requests(new_sheet_id, calendar_layout))
+            for new_sheet_id, sheet_title, calendar_layout in month_sheets
+        ],
+        first_index,
+    )
+
+
+def main(academic_year=None, use_template=False):
+    if academic_year is None:
+        academic_year = current_academic_year()
+    print(f"[Debug] Academic year: {academic_year}, template mode: {use_template}")
     initialize_firebase()
     sheets_service = get_google_sheets_service()
 
@@ -289,6 +302,16 @@ def main():
         print("[Debug] Firebaseから学生インデックスを取得できませんでした。空のデータとして処理を続行します。")
         student_indices = {}
 
+    # シート名・sheetId はスプレッドシートごとに1回だけ取得する
+    metadata_cache = SheetMetadataCache(sheets_service, execute_with_retry)
+
+    # コース一覧は全学生で共通なので、ループの外で1回だけ取得して辞書化する
+    courses_dict = load_courses_dict()
+    if courses_dict is None:
+        print("[Debug] Courses データが不正です。処理を中止します。")
+        return
+
+    processed_students = 0
     for student_index, student_data in student_indices.items():
         print(f"[Debug] Processing student index: {student_index}")
         sheet_id = student_data.get("sheet_id")
@@ -310,18 +333,6 @@ def main():
 
         print(f"[Debug] 学生インデックス {student_index} の登録コース: {student_course_ids}")
 
-        courses = get_firebase_data("Courses/course_id")
-        if not isinstance(courses, list):
-            print("[Debug] Courses データが不正です。処理を中止します。")
-            continue
-
-        # Coursesデータを辞書化
-        courses_dict = {
-            str(index): course
-            for index, course in enumerate(courses)
-            if course is not None and isinstance(course, dict)
-        }
-
         # 学生のコース名リストを作成
         course_names = []
         for cid in student_course_ids:
@@ -336,20 +347,48 @@ def main():
             print(f"[Debug] 学生インデックス {student_index} のコース名が見つかりませんでした。")
             continue
 
-        # 各月のシートを作成・更新
-        for month in range(1, 13):
-            print(f"[Debug] Processing month: {month} for student index: {student_index}")
-            requests = prepare_update_requests(sheet_id, course_names, month, sheets_service, sheet_id)
-            if not requests:
-                print(f"[Debug] 月 {month} のシートを更新するリクエストがありません。")
-                continue
+        # 既存のシート名と sheetId はキャッシュから取得し、12か月分のシート名と sheetId をローカルで決める
+        first_index = len(metadata_cache.sheet_ids(sheet_id))
+        month_sheets = []
+        for year, month in academic_year_months(academic_year):
+            print(f"[Debug] Processing month: {year}-{month:02d} for student index: {student_index}")
+            calendar_layout = get_month_calendar(year, month)
+            sheet_title = generate_unique_sheet_title(metadata_cache, sheet_id, calendar_layout.sheet_title)
+            new_sheet_id = metadata_cache.allocate_sheet_id(sheet_id, year * 100 + month)
+            month_sheets.append((new_sheet_id, sheet_title, calendar_layout))
+
+        # 12か月分のシート追加と書式設定を1回の batchUpdate にまとめる
+        if use_template:
+            template_title, template_sheet_id = allocate_template_sheet(metadata_cache, sheet_id, academic_year * 100)
+            requests = prepare_template_requests(
+                template_sheet_id, template_title, month_sheets, course_names, first_index
+            )
+        else:
+            requests = []
+            for new_sheet_id, sheet_title, calendar_layout in month_sheets:
+                requests.extend(prepare_update_requests(new_sheet_id, sheet_title, course_names, calendar_layout))
 
+        execute_with_retry(
             sheets_service.spreadsheets().batchUpdate(
                 spreadsheetId=sheet_id,
-                body={"requests": requests},
-            ).execute()
-            print(f"[Debug] 月 {month} のシートを正常に更新しました。")
+                body={"requests": coalesce_requests(requests)},
+            )
+        )
+        if use_template:
+            # テンプレートシートは同じ batchUpdate の最後で削除済み
+            metadata_cache.remove_sheet(sheet_id, template_title, template_sheet_id)
+        processed_students += 1
+        print(f"[Debug] 学生インデックス {student_index} の12か月分のシートを正常に作成しました。")
+
+    print(
+        f"[Debug] Run summary: students processed={processed_students}, "
+        f"Firebase reads={firebase_read_count}, "
+        f"sheet metadata reads={metadata_cache.fetch_count}"
+    )
 
 
 if __name__ == "__main__":
-    main()
+    # 引数で年度を指定できる (例: python write_schedule.py 2025)。省略時は今日の日付から決める
+    # --template を付けると、テンプレートシートを複製して各月のシートを作成する
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    main(int(args[0]) if args else None, use_template="--template" in sys.argv[1:])